@@ -0,0 +1,235 @@
+import logging
+import time
+import numpy as np
+import pandas as pd
+
+# Geography levels of the cube, from the coarsest
+GEOGRAPHY_LEVELS = ('province', 'area', 'area_district')
+
+# Time grains of the cube and their pandas period; 'day' cells only hold the
+# sum and count, enough to aggregate the mean over any date range
+GRAINS = {'year': 'Y', 'month': 'M', 'day': 'D'}
+
+PERCENTILES = {'p10': 0.1, 'p25': 0.25, 'p75': 0.75, 'p90': 0.9}
+
+# Rooms value of the cells covering every room count
+ALL_ROOMS = 'All'
+
+CUBE_INDEX = ['level', 'grain', 'rooms', 'geography', 'period']
+
+# Quantile sketches of the incremental cube: log-spaced buckets, so any
+# quantile is read within SKETCH_ACCURACY relative error (a DDSketch)
+SKETCH_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_GRAINS = ('year',)
+STATE_INDEX = CUBE_INDEX + ['bucket']
+KEY_COLUMNS = ['level', 'grain', 'rooms', 'geography']
+
+# Bump when the rows folded in an incremental cube would be classified or
+# valued differently, so that persisted states are rebuilt
+CUBE_VERSION = 1
+
+
+def build_cube(df, date_column, rooms_column, value_column='unit_price'):
+    """
+    Statistics of `value_column` per geography level x time grain x room count.
+
+    Parameters:
+        df (DataFrame): Listings or leases, with the GEOGRAPHY_LEVELS columns.
+        date_column (str): Date the rows are bucketed on ('lease_date', 'date_published').
+        rooms_column (str): Number of rooms ('Rooms', 'number_of_rooms').
+
+    Returns:
+        DataFrame: One row per non-empty cell, indexed by CUBE_INDEX, with
+        'count', 'sum', 'mean', 'median' and the PERCENTILES columns. Cells
+        with rooms == ALL_ROOMS cover every room count; 'day' cells have no
+        median or percentiles.
+    """
+    rows, values = _cube_rows(df, date_column, rooms_column, value_column)
+    cells = []
+    for level, grain, keys in _cell_keys(rows, date_column, rooms_column):
+        grouped = values.groupby(keys)
+        if grain == 'day':
+            stats = grouped.agg(['count', 'sum'])
+        else:
+            stats = grouped.agg(['count', 'sum', 'mean', 'median']).join(
+                grouped.quantile(list(PERCENTILES.values())).unstack().set_axis(list(PERCENTILES), axis=1))
+        cells.append(stats.assign(level=level, grain=grain))
+    cube = pd.concat(cells).reset_index()
+    return cube.set_index(CUBE_INDEX).sort_index()
+
+
+def _cube_rows(df, date_column, rooms_column, value_column):
+    rows = df[[*GEOGRAPHY_LEVELS, date_column, rooms_column, value_column]].dropna(subset=[date_column, value_column])
+    return rows, rows[value_column].astype(float)
+
+
+def _cell_keys(rows, date_column, rooms_column):
+    """(level, grain, [rooms, geography, period] keys) of every cell grouping; day cells are not split by rooms."""
+    every_room = pd.Series(ALL_ROOMS, index=rows.index, name='rooms')
+    for grain, frequency in GRAINS.items():
+        period = rows[date_column].dt.to_period(frequency).dt.start_time.rename('period')
+        for level in GEOGRAPHY_LEVELS:
+            room_splits = (every_room,) if grain == 'day' else (every_room, rows[rooms_column].astype(object).rename('rooms'))
+            for rooms in room_splits:
+                yield level, grain, [rooms, rows[level].rename('geography'), period]
+
+
+def cube_table(cube, level, statistic='mean', grain='year', rooms=ALL_ROOMS):
+    """
+    Geography x period table of one statistic, a slice of the cube.
+
+    With the defaults it equals
+    `df.groupby([level, 'lease_year'])['unit_price'].mean().unstack()`;
+    yearly columns are labelled by year.
+    """
+    try:
+        cells = cube.loc[(level, grain, rooms)]
+    except KeyError:
+        return pd.DataFrame()
+    table = cells[statistic].unstack()
+    if grain == 'year':
+        table.columns = table.columns.year
+    table.index.name = level
+    return table
+
+
+def cube_range(cube, level, start=None, end=None, rooms=ALL_ROOMS):
+    """
+    Mean value per geography over the rows dated between `start` and `end` (inclusive).
+
+    Summed from the daily cells, so it matches filtering the rows on their
+    date and averaging, at the cost of slicing the cube.
+    """
+    try:
+        cells = cube.loc[(level, 'day', rooms)]
+    except KeyError:
+        return pd.Series(dtype=float, name='unit_price')
+    period = cells.index.get_level_values('period')
+    start = pd.Timestamp(start) if start is not None else period.min()
+    end = pd.Timestamp(end) if end is not None else period.max()
+    cells = cells[(period >= start) & (period <= end)]
+    totals = cells.groupby(level='geography')[['sum', 'count']].sum()
+    return (totals['sum'] / totals['count']).rename('unit_price')
+
+
+class IncrementalCube:
+    """
+    Cube of an append-only table (the lease history), updated from its new rows only.
+
+    The state holds, per cell, the count and sum of the values and, for the
+    SKETCH_GRAINS, a histogram over log-spaced buckets from which the median
+    and percentiles are read within SKETCH_ACCURACY. Both merge by addition,
+    so folding the rows appended since the last update into the state gives
+    the same result as a rebuild over the whole table, at a cost proportional
+    to the new rows. The state is kept in the snapshot store with the last
+    id folded in.
+
+    Unlike `build_cube`, month cells have no median or percentiles.
+    """
+
+    def __init__(self, store, name, date_column='lease_date', rooms_column='Rooms', value_column='unit_price'):
+        self.store = store
+        self.name = name
+        self.date_column = date_column
+        self.rooms_column = rooms_column
+        self.value_column = value_column
+        self.state = None
+        self.through_id = None
+
+    def update(self, df):
+        """Fold the rows of `df` with an id above the last one folded in, persist the state and return the cube."""
+        start = time.perf_counter()
+        self._read()
+        ids = df['id'].astype('float64')
+        if self.state is None or ids.max() < self.through_id:
+            return self.rebuild(df)
+        new_rows = df[ids > self.through_id]
+        if not new_rows.empty:
+            self.state = _merge_states([self.state, self._fold(new_rows)])
+            self.through_id = int(ids.max())
+            self._write()
+        logging.info(f"Cube '{self.name}': {len(new_rows)} new rows folded in {time.perf_counter() - start:.2f}s.")
+        return self.cube()
+
+    def rebuild(self, df):
+        """Recompute the state from every row of `df`, persist it and return the cube."""
+        start = time.perf_counter()
+        self.state = self._fold(df)
+        self.through_id = int(df['id'].astype('float64').max()) if len(df) else -1
+        self._write()
+        logging.info(f"Cube '{self.name}': rebuilt from {len(df)} rows in {time.perf_counter() - start:.2f}s.")
+        return self.cube()
+
+    def verify(self, df):
+        """True if the state equals a rebuild over `df` (the whole table), without replacing it."""
+        rebuilt = self._fold(df)
+        state = self.state if self.state is not None else self._fold(df.iloc[:0])
+        if not state.index.equals(rebuilt.index) or not (state['count'] == rebuilt['count']).all():
+            logging.warning(f"Cube '{self.name}': cells differ from a rebuild.")
+            return False
+        if not np.allclose(state['sum'], rebuilt['sum']):
+            logging.warning(f"Cube '{self.name}': sums differ from a rebuild.")
+            return False
+        return True
+
+    def cube(self):
+        """The statistics of the state, in the format of `build_cube`."""
+        cells = self.state.groupby(level=CUBE_INDEX)[['count', 'sum']].sum()
+        cells['mean'] = cells['sum'] / cells['count']
+
+        sketches = self.state[self.state.index.get_level_values('grain').isin(SKETCH_GRAINS)]['count']
+        cumulative = sketches.groupby(level=CUBE_INDEX).cumsum()
+        total = sketches.groupby(level=CUBE_INDEX).sum()
+        buckets = pd.Series(sketches.index.get_level_values('bucket'), index=sketches.index)
+        for name, q in {'median': 0.5, **PERCENTILES}.items():
+            # Linear interpolation between the values of the ranks around the quantile, as pandas does
+            rank = q * (total - 1)
+            rank_of_bucket = rank.reindex(cumulative.index.droplevel('bucket')).to_numpy()
+            low = self._value_at_rank(buckets, cumulative, np.floor(rank_of_bucket))
+            high = self._value_at_rank(buckets, cumulative, np.ceil(rank_of_bucket))
+            cells[name] = (low + (rank - np.floor(rank)) * (high - low)).reindex(cells.index)
+        return cells.sort_index()
+
+    @staticmethod
+    def _value_at_rank(buckets, cumulative, rank):
+        """Representative value of the bucket holding the 0-based `rank` of each cell."""
+        bucket = buckets[cumulative > rank].groupby(level=CUBE_INDEX).first()
+        return 2 * SKETCH_GAMMA ** bucket.astype(float) / (SKETCH_GAMMA + 1)
+
+    def _fold(self, df):
+        """State of the rows of `df` alone."""
+        rows, values = _cube_rows(df, self.date_column, self.rooms_column, self.value_column)
+        bucket = pd.Series(sketch_buckets(values.to_numpy()), index=rows.index, name='bucket')
+        no_bucket = pd.Series(0, index=rows.index, name='bucket')
+        states = []
+        for level, grain, keys in _cell_keys(rows, self.date_column, self.rooms_column):
+            keys = keys + [bucket if grain in SKETCH_GRAINS else no_bucket]
+            states.append(values.groupby(keys).agg(['count', 'sum']).assign(level=level, grain=grain))
+        if not states:
+            return pd.DataFrame(columns=STATE_INDEX + ['count', 'sum']).set_index(STATE_INDEX)
+        return _merge_states([state.reset_index().set_index(STATE_INDEX) for state in states])
+
+    def _read(self):
+        state = self.store.read(self.name)
+        if state.empty or (state['version'] != CUBE_VERSION).any():
+            self.state, self.through_id = None, None
+            return
+        self.through_id = int(state['through_id'].iloc[0])
+        keys = {column: object for column in KEY_COLUMNS}
+        self.state = state.drop(columns=['version', 'through_id']).astype(keys).set_index(STATE_INDEX)
+
+    def _write(self):
+        # Keys are stored dictionary-encoded, most of the state is repeated labels
+        keys = {column: 'category' for column in KEY_COLUMNS}
+        state = self.state.reset_index().astype(keys)
+        self.store.write(self.name, state.assign(version=CUBE_VERSION, through_id=self.through_id))
+
+
+def sketch_buckets(values):
+    """Log bucket of each (positive) value; the bucket k covers (gamma^(k-1), gamma^k]."""
+    return np.ceil(np.log(np.maximum(values, 1e-9)) / np.log(SKETCH_GAMMA)).astype(np.int64)
+
+
+def _merge_states(states):
+    return pd.concat(states).groupby(level=STATE_INDEX).sum().sort_index()
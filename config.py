@@ -0,0 +1,86 @@
+import os
+import tomllib
+
+# Settings files, later ones override earlier ones. `.streamlit/secrets.toml` is
+# read directly so the dashboard secrets keep working outside Streamlit.
+CONFIG_FILES = [
+    os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml"),
+    os.path.join(".streamlit", "secrets.toml"),
+    "hk_housing.toml",
+]
+
+DEFAULTS = {
+    'database': {},
+    'scraper': {
+        'max_concurrency': 20,
+        'max_per_host': 10,
+        'rate': 10.0,
+        'http_cache': "http_cache.sqlite",
+        # Seconds a cached page is served without revalidation, per URL class
+        # ('index', 'detail', 'history', 'other'), over http_cache.DEFAULT_TTLS
+        'http_cache_ttls': {},
+        # Seconds after which a page not fetched again is dropped from the cache,
+        # pruned at the end of each refresh; keep it above the TTLs
+        'http_cache_max_age': 7 * 24 * 3600,
+    },
+    'refresh': {
+        # Base name of the checkpoint files, one per refresh command, see refresh_job.checkpoint_path
+        'checkpoint': "refresh_checkpoint.sqlite",
+    },
+    'snapshot': {
+        'directory': "snapshots",
+    },
+    'dashboard': {
+        # Commute anchors offered by default, name = [latitude, longitude]
+        'anchors': {'Office': [22.28492, 114.15951]},
+        # Memory budget of the rendered maps and figures kept across reruns
+        'render_cache_mb': 64,
+    },
+}
+
+# Environment variables overriding a (section, key) setting
+ENV_OVERRIDES = {
+    'SUPABASE_URL': ('database', 'SUPABASE_URL'),
+    'SUPABASE_KEY': ('database', 'SUPABASE_KEY'),
+    'HK_HOUSING_MAX_CONCURRENCY': ('scraper', 'max_concurrency'),
+    'HK_HOUSING_RATE': ('scraper', 'rate'),
+    'HK_HOUSING_HTTP_CACHE': ('scraper', 'http_cache'),
+    'HK_HOUSING_HTTP_CACHE_MAX_AGE': ('scraper', 'http_cache_max_age'),
+    'HK_HOUSING_CHECKPOINT': ('refresh', 'checkpoint'),
+    'HK_HOUSING_SNAPSHOT_DIR': ('snapshot', 'directory'),
+    'HK_HOUSING_RENDER_CACHE_MB': ('dashboard', 'render_cache_mb'),
+}
+
+_config = None
+
+
+def load_config():
+    """
+    Build the configuration from DEFAULTS, the TOML files and the environment.
+
+    The TOML file path can be set with HK_HOUSING_CONFIG. Values coming from
+    the environment are cast to the type of their default.
+    """
+    config = {section: dict(values) for section, values in DEFAULTS.items()}
+    paths = CONFIG_FILES + ([os.environ["HK_HOUSING_CONFIG"]] if "HK_HOUSING_CONFIG" in os.environ else [])
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for section, values in tomllib.load(f).items():
+                    if isinstance(values, dict):
+                        config.setdefault(section, {}).update(values)
+
+    for variable, (section, key) in ENV_OVERRIDES.items():
+        if variable in os.environ:
+            default = DEFAULTS.get(section, {}).get(key)
+            value = os.environ[variable]
+            config.setdefault(section, {})[key] = type(default)(value) if default is not None else value
+    return config
+
+
+def setting(section, key, default=None):
+    """Return one configuration value, loading the configuration on first use."""
+    global _config
+    if _config is None:
+        _config = load_config()
+    return _config.get(section, {}).get(key, default)
@@ -0,0 +1,226 @@
+import asyncio
+import queue
+import threading
+import aiohttp
+from config import setting
+from http_cache import ResponseCache
+from rate_limit import RateController, parse_retry_after
+
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+
+class CrawlEngine:
+    """
+    Shared asyncio HTTP engine used by every scraping phase.
+
+    The engine owns one event loop running in a background thread and one
+    aiohttp session on top of it, so connections are kept alive across pages,
+    listings and buildings. Synchronous callers submit work with `fetch_one`,
+    `fetch_all` or `iter_fetch`; coroutines scheduled with `submit` can await
+    `fetch` directly.
+
+    Every request goes through a shared RateController (token bucket, AIMD
+    concurrency limit and Retry-After handling); `max_concurrency` is the
+    ceiling of its adaptive limit.
+
+    Parameters:
+        max_concurrency (int): Maximum number of requests in flight overall.
+        max_per_host (int): Maximum number of open connections per host.
+        timeout (float): Total timeout of a single request in seconds.
+        max_retries (int): Number of retries after a failed request.
+        keepalive_timeout (float): Seconds an idle connection is kept open.
+        headers (dict): Headers sent with every request.
+        cache (ResponseCache): Optional on-disk response cache used for conditional GETs.
+        rate_controller (RateController): Rate control shared by all requests, one is created by default.
+    """
+
+    def __init__(self, max_concurrency=20, max_per_host=10, timeout=10, max_retries=2,
+                 keepalive_timeout=30, headers=None, cache=None,
+                 rate_controller=None):
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.keepalive_timeout = keepalive_timeout
+        self.headers = headers or DEFAULT_HEADERS
+        self.cache = cache
+        self.rate_controller = rate_controller or RateController(max_concurrency=max_concurrency)
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    # Event loop management
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run_loop, name="crawl-engine", daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+            asyncio.run_coroutine_threadsafe(self._open_session(), loop).result()
+
+    async def _open_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrency,
+            limit_per_host=self.max_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    def close(self):
+        """Close the session and stop the background event loop."""
+        with self._lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+            self._session = None
+
+    def submit(self, coro):
+        """Schedule a coroutine on the engine loop and return a concurrent Future."""
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    # Coroutine API
+
+    async def _in_thread(self, function, *args):
+        """Run blocking work, such as the SQLite and zlib calls of the response cache, off the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def _request(self, url, headers=None):
+        started_at = await self.rate_controller.acquire()
+        status, retry_after = None, None
+        try:
+            async with self._session.get(url, headers=headers) as response:
+                status = response.status
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                return status, response.headers, await response.text()
+        finally:
+            await self.rate_controller.release(started_at, status, retry_after)
+
+    async def fetch(self, url):
+        """Fetch a URL and return its text, or None once all retries have failed."""
+        entry = await self._in_thread(self.cache.lookup, url) if self.cache else None
+        if entry is not None and self.cache.is_fresh(url, entry):
+            self.cache.record('hits')
+            return entry['body']
+        conditional_headers = self.cache.conditional_headers(entry) if self.cache else None
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                status, headers, text = await self._request(url, conditional_headers)
+                if status == 304 and entry is not None:
+                    await self._in_thread(self.cache.touch, url)
+                    self.cache.record('revalidated')
+                    return entry['body']
+                if status == 200:
+                    if self.cache:
+                        await self._in_thread(self.cache.store, url, text, headers.get('ETag'), headers.get('Last-Modified'))
+                        self.cache.record('misses')
+                    return text
+                print(f"Failed to fetch {url} with status code {status}")
+                if status < 500 and status != 429:
+                    return None
+                retry_after = parse_retry_after(headers.get('Retry-After'))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Error fetching {url} (attempt {attempt + 1}): {e}")
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.rate_controller.backoff_delay(attempt, retry_after))
+
+        print(f"Giving up on {url} after {self.max_retries + 1} attempts.")
+        return None
+
+    async def _fetch_all(self, urls):
+        results = await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+        return [None if isinstance(result, Exception) else result for result in results]
+
+    def stats(self):
+        """Return the rate controller statistics and the response cache counters."""
+        return {
+            'rate': self.rate_controller.stats(),
+            'cache': self.cache.stats() if self.cache else {},
+        }
+
+    # Synchronous API
+
+    def fetch_one(self, url):
+        """Fetch a single URL and return its text (or None)."""
+        return self.submit(self.fetch(url)).result()
+
+    def fetch_all(self, urls):
+        """Fetch all URLs concurrently and return their texts in the order of `urls`."""
+        return self.submit(self._fetch_all(list(urls))).result()
+
+    def iter_fetch(self, urls, max_pending=None):
+        """
+        Fetch URLs concurrently and yield (url, text) pairs as they complete.
+
+        Results are handed over to the calling thread, so callers can update
+        progress bars or parse pages while the remaining requests are in flight.
+        With `max_pending`, at most that many fetched pages wait for the caller
+        to pick them up; further requests are held back until it catches up.
+        """
+        urls = list(urls)
+        results = queue.Queue()
+        slots = []
+
+        async def fetch_into_queue(url):
+            if slots:
+                await slots[0].acquire()
+            try:
+                results.put((url, await self.fetch(url)))
+            except Exception as e:
+                print(f"Error fetching {url}: {e}")
+                results.put((url, None))
+
+        async def fetch_everything():
+            if max_pending:
+                slots.append(asyncio.Semaphore(max_pending))
+            await asyncio.gather(*(fetch_into_queue(url) for url in urls))
+
+        future = self.submit(fetch_everything())
+        for _ in range(len(urls)):
+            item = results.get()
+            if slots:
+                self._loop.call_soon_threadsafe(slots[0].release)
+            yield item
+        future.result()
+
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the process-wide engine shared by all scraping phases."""
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            max_concurrency = setting('scraper', 'max_concurrency')
+            _default_engine = CrawlEngine(
+                max_concurrency=max_concurrency,
+                max_per_host=setting('scraper', 'max_per_host'),
+                cache=ResponseCache(setting('scraper', 'http_cache'), ttls=setting('scraper', 'http_cache_ttls')),
+                rate_controller=RateController(rate=setting('scraper', 'rate'), max_concurrency=max_concurrency),
+            )
+        return _default_engine
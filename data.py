@@ -1,4 +1,6 @@
 import datetime
+import functools
+import re
 import pandas as pd
 import streamlit as st
 import numpy as np
@@ -6,8 +8,22 @@ import requests
 import json
 from web_scrapping import *
 from database import *
-from geopy.distance import geodesic
+from refresh_job import RefreshJob
+from snapshot_store import SnapshotStore
+from progress import StreamlitProgress
+from schema import DETAILS_SCHEMA, HISTORY_SCHEMA, normalize
+from distances import citymapper_urls, distance_matrix, distances_from
+from config import setting
+from spatial_index import DistrictIndex, SpatialIndex
+from valuation import comparable_estimates
+from aggregates import IncrementalCube, build_cube, cube_range, cube_table
+from listing_query import ListingQueryEngine
+from geometry import FULL_RESOLUTION, load_geometry
+from render_cache import RenderCache, render_key
 OFFICE_COORD = (22.28492, 114.15951)
+HISTORY_CUBE = 'property_listing_history_cube'
+# Distance settings (anchors, combination, weights) whose query engine is kept; each indexes every listing
+MAX_QUERY_ENGINES = 8
 
 # Define provinces and areas
 provinces = ['HK Island', 'Kowloon', 'New Territories', 'Islands']
@@ -107,7 +123,7 @@ areas_mapping = {
 }
 DISPLAY_COLUMNS=[
     'date_published','province', 'area', 'lease_price','floor_size', 'unit_price',
-    'historical_average','unit_price_vs_histo', 'floor_zone', 'number_of_rooms', 
+    'historical_average','comparable_count','unit_price_vs_histo', 'floor_zone', 'number_of_rooms', 
     'number_of_bathrooms', 'num_units', 'distance_to_office_km', 'address','name',
     'url','url_history','url_transit','latitude','longitude'
 ]
@@ -119,14 +135,6 @@ SHORT_DISPLAY_COLUMNS=[
     'date_published', 'distance_to_office_km', 'address'
 ]
 
-COLUMNS_DETAILS_DB = ['date_published', 'property_number',
-       'price', 'floor_size', 'floor_size_unit', 'unit_price' ,
-       'latitude', 'longitude', 'address', 'name',
-        'number_of_rooms', 'number_of_bathrooms', 'num_units', 'floor_zone',
-        'property_type', 'description', 'url', 'url_history',
-       ]
-
-
 # Functions to extract province and area
 def extract_province(address):
     for province in provinces:
@@ -141,31 +149,67 @@ def extract_area(address, province):
                 return area
     return None
 
-def update_database(now_ts):
-    property_numbers_list = list_of_properties_scrapping()
-    df_listing_numbers = pd.DataFrame(property_numbers_list, columns=['property_number'])
-    df_listing_numbers['update_time'] = now_ts
-    df_listing_numbers['update_time']= pd.to_datetime(df_listing_numbers['update_time'], unit='s')
-    df_listing_numbers['update_time']=df_listing_numbers['update_time'].astype(str)
-    db.save_data(df_listing_numbers, "property_listing_numbers")
-    
-    df_listing_old = db.load_data("property_listing_details")
-    old_number_list = list(df_listing_old['property_number'])
-    new_listing = [num for num in property_numbers_list if num not in old_number_list]
-    df_listing_new = get_properties_dataframe_parallel(new_listing)
-    df_listing_new = df_listing_new.dropna(subset=['property_number']).reset_index()
-    df_listing_new['property_number']=df_listing_new['property_number'].astype(int)
-    df_listing_new = df_listing_new[COLUMNS_DETAILS_DB]
-    df_concat_listing = pd.concat([df_listing_old, df_listing_new]).reset_index(drop=True)
-    df_concat_listing = df_concat_listing[lambda x : x.date_published!='Not available'].sort_values('date_published',ascending=False).drop('id',axis=1).reset_index(drop=True)
-    df_concat_listing = df_concat_listing.astype(str)
-    df_concat_listing['property_number']=df_concat_listing['property_number'].astype(int)
-    db.save_data(df_concat_listing[lambda x : x.property_number.isin(property_numbers_list)], "property_listing_details")
+def first_match_pattern(names):
+    """
+    Regex capturing the first of `names`, in list order, found anywhere in a string.
+
+    Each name is a lookahead alternative with its own group; alternatives are
+    tried in order, so the group that matched is the one `extract_province`
+    and `extract_area` would return.
+    """
+    return "^(?:" + "|".join(f"(?=.*?({re.escape(name)}))" for name in names) + ")"
+
+PROVINCE_PATTERN = first_match_pattern(provinces)
+AREA_PATTERNS = {province: first_match_pattern(areas) for province, areas in areas_mapping.items()}
+
+def _extract_first(values, pattern):
+    # Only the group of the alternative that matched is set
+    groups = values.str.extract(pattern, flags=re.DOTALL)
+    return groups.bfill(axis=1).iloc[:, 0].astype(object).where(lambda x: x.notna(), None)
+
+def classify_addresses(addresses):
+    """
+    Vectorized `extract_province`, `extract_area` and district lookup.
+
+    Each distinct address is classified once. Missing addresses get no
+    province nor area.
+
+    Returns:
+        DataFrame: 'province', 'area' and 'area_district' columns aligned with `addresses`.
+    """
+    unique = pd.Series(addresses.dropna().unique(), dtype=object)
+    province = _extract_first(unique, PROVINCE_PATTERN)
+    area = pd.Series(None, index=unique.index, dtype=object)
+    for name, pattern in AREA_PATTERNS.items():
+        in_province = province == name
+        if in_province.any():
+            area[in_province] = _extract_first(unique[in_province], pattern)
+    district = [neighborhood_to_district.get(name, 'Unknown') for name in area]
+    by_address = pd.DataFrame({'province': province.values, 'area': area.values, 'area_district': district}, index=unique.values)
+
+    result = by_address.reindex(addresses.values).set_axis(addresses.index)
+    result['area_district'] = result['area_district'].fillna('Unknown')
+    return result.astype(object).where(result.notna(), None)
+
+def update_database(now_ts, full_sweep=True, progress=None):
+    """
+    Refresh the listing tables.
+
+    A full sweep crawls every index page and drops delisted properties. An
+    incremental run (`full_sweep=False`) only walks the newest index pages
+    until it reaches known property numbers, which is cheap enough to run
+    hourly; a full sweep should still run from time to time to detect
+    delistings. The refresh is checkpointed: if it fails partway, the next
+    call resumes it instead of starting over.
+    """
+    RefreshJob(progress=progress).run(now_ts, phases=('listings', 'details'), full_sweep=full_sweep)
 
 @st.cache_data
 def load_data(now_ts):
-    df_listing = db.load_data("property_listing_details")
-    df_history = db.load_data("property_listing_history")
+    # Local snapshots, topped up with the rows changed in Supabase since the last load
+    snapshots = SnapshotStore()
+    df_listing = snapshots.load("property_listing_details")
+    df_history = snapshots.load("property_listing_history")
     update_dt = datetime.datetime.now(tz=datetime.timezone.utc)
     fx_rates = transform_fx_rates(get_fx_rates())
     coordinates_map=coordinates_map_districts()
@@ -173,41 +217,141 @@ def load_data(now_ts):
     df_history = process_data_history(df_history)
     return df_listing, df_history, fx_rates, coordinates_map, update_dt
 
+@functools.lru_cache(maxsize=1)
+def get_district_index():
+    return DistrictIndex(coordinates_map_districts())
+
+def assign_districts(df):
+    """
+    District of each row from its coordinates.
+
+    Rows whose location falls outside every district polygon (reclaimed
+    land, coarse coordinates) keep the district derived from their address.
+    """
+    by_polygon = pd.Series(get_district_index().assign(df['latitude'], df['longitude']), index=df.index, dtype=object)
+    return by_polygon.fillna(df['area_district'])
+
+@st.cache_resource
+def spatial_indexes(now_ts):
+    """R-trees over the listings and the lease history of `load_data(now_ts)`, built once per data load."""
+    df_listing, df_history = load_data(now_ts)[:2]
+    return {'listing': SpatialIndex(df_listing), 'history': SpatialIndex(df_history)}
+
+@st.cache_data
+def listing_valuations(now_ts):
+    """Comparable-lease estimates of the listings of `load_data(now_ts)`, see `comparable_estimates`."""
+    df_listing, df_history = load_data(now_ts)[:2]
+    return comparable_estimates(df_listing, df_history, spatial_indexes(now_ts)['history'])
+
+@st.cache_resource
+def aggregate_cubes(now_ts):
+    """
+    Unit price statistics of the listings and the lease history of `load_data(now_ts)`, see `build_cube`.
+
+    Built once per data load and shared rather than copied on each rerun:
+    callers only slice the cubes.
+    """
+    df_listing, df_history = load_data(now_ts)[:2]
+    return {'listing': build_cube(df_listing, 'date_published', 'number_of_rooms'),
+            'history': history_cube(df_history)}
+
+def history_cube(df_history, rebuild=False):
+    """
+    Cube of the lease history, updated from the leases appended since the last
+    load (see `IncrementalCube`) and kept with the snapshots.
+    """
+    cube = IncrementalCube(SnapshotStore(), HISTORY_CUBE)
+    return cube.rebuild(df_history) if rebuild else cube.update(df_history)
+
+def default_anchors():
+    """Commute anchors of the [dashboard] settings as a ((name, latitude, longitude), ...) tuple."""
+    return tuple((name, float(lat), float(lon)) for name, (lat, lon) in setting('dashboard', 'anchors').items())
+
+def anchor_column(name):
+    return f"distance_{name}_km"
+
+@st.cache_data
+def anchor_distances(now_ts, anchors):
+    """
+    Distances (km) from every listing to every anchor, one column per anchor.
+
+    Computed as one matrix and cached per data load and anchor set, so
+    filters on the distances do not recompute them on reruns.
+
+    Parameters:
+        now_ts (float): Timestamp of the data load, see `load_data`.
+        anchors (tuple): ((name, latitude, longitude), ...) of the anchors.
+
+    Returns:
+        DataFrame: Indexed like the listings of `load_data(now_ts)`.
+    """
+    df_listing = load_data(now_ts)[0]
+    matrix = distance_matrix(df_listing['latitude'], df_listing['longitude'], [(lat, lon) for _, lat, lon in anchors])
+    return pd.DataFrame(matrix, index=df_listing.index, columns=[anchor_column(name) for name, _, _ in anchors])
+
+def combined_distance(distances, how='min', weights=None):
+    """
+    Reduce the anchor distances of each listing to one value.
+
+    Parameters:
+        distances (DataFrame): Output of `anchor_distances`.
+        how (str): 'min' (closest anchor), 'max' (farthest anchor) or 'weighted' (weighted mean).
+        weights (list): Weight of each anchor for 'weighted', equal weights by default.
+    """
+    if how == 'min':
+        return distances.min(axis=1)
+    if how == 'max':
+        return distances.max(axis=1)
+    if how == 'weighted':
+        return pd.Series(np.average(distances.to_numpy(), axis=1, weights=weights), index=distances.index)
+    raise ValueError(f"Unknown distance combination '{how}', expected 'min', 'max' or 'weighted'")
+
+@st.cache_resource(max_entries=MAX_QUERY_ENGINES)
+def listing_query_engine(now_ts, anchors, how='min', weights=None):
+    """
+    Query engine over the listings of `load_data(now_ts)`, with their combined
+    distance to `anchors` as 'distance_km' (see `combined_distance`).
+
+    Built once per data load and distance setting, the MAX_QUERY_ENGINES
+    most recent ones are kept; filter answers are row positions in the listings of `load_data(now_ts)`.
+    """
+    df_listing = load_data(now_ts)[0]
+    distance_km = combined_distance(anchor_distances(now_ts, anchors), how, list(weights) if weights else None) if anchors else 0.0
+    return ListingQueryEngine(df_listing.assign(distance_km=distance_km))
+
 def process_data_listing(df):
+    # Columns are stored typed, this is only a cast
+    df = normalize(df, DETAILS_SCHEMA)
     df = df[lambda x : x.property_type!='Office']
-    df = df.replace('nan', np.nan)
-    df = df.dropna(subset=['date_published'])
+    df = df.dropna(subset=['date_published', 'price'])
     df = fix_coordinates(df)
     df['distance_to_office_km']=distance_to_office(df)
     df['url_transit']=transit_url(df)
-    df['province'] = df['address'].apply(extract_province)
-    df['area'] = df.apply(lambda row: extract_area(row['address'], row['province']), axis=1)
-    df['area_district'] = df['area'].apply(lambda x: neighborhood_to_district.get(x, 'Unknown'))
-    df["lease_price"] = df["price"].str.extract(r"HKD\$([\d,]+)").replace(",", "", regex=True).astype(int)
-    df['floor_size'] = pd.to_numeric(df['floor_size'], errors='coerce')  # Convert to numeric, set 'Not Available' as NaN
-    df['unit_price'] = df['lease_price'].astype(int) / df['floor_size'] 
+    df[['province', 'area', 'area_district']] = classify_addresses(df['address'])
+    df['area_district'] = assign_districts(df)
+    df["lease_price"] = df["price"].astype(int)
+    # Rows scraped before the schema was typed have no stored unit price
+    df['unit_price'] = df['lease_price'] / df['floor_size']
     return df
 
 def process_data_history(df):
-    df = df.replace('nan', np.nan)
+    df = normalize(df, HISTORY_SCHEMA)
+    df = df.dropna(subset=['Leased Price (HKD)', 'Lease Date'])
     df = fix_coordinates(df)
-    df['province'] = df['address'].apply(extract_province)
-    df['area'] = df.apply(lambda row: extract_area(row['address'], row['province']), axis=1)
-    df['area_district'] = df['area'].apply(lambda x: neighborhood_to_district.get(x, 'Unknown'))
+    df[['province', 'area', 'area_district']] = classify_addresses(df['address'])
+    df['area_district'] = assign_districts(df)
     df=df.rename(columns={'Size (ft²)':'floor_size',
                  'Unit Price (HKD/ft²)': 'unit_price',
                  'Leased Price (HKD)' : 'lease_price'
                  })
-    df['floor_size'] = pd.to_numeric(df['floor_size'], errors='coerce')
     df['unit_price'] = df['lease_price'].astype(int) / df['floor_size'] 
-    df['lease_date']=pd.to_datetime(df['Lease Date'],format="%d/%m/%Y")
-    df['lease_year'] = df['lease_date'].apply(lambda x : x.year)
+    df['lease_date']=df['Lease Date']
+    df['lease_year'] = df['lease_date'].dt.year
     return df
 
 def fix_coordinates(df): # TO MODIFY TO OVERWRITE COORD FROM ADDRESS
-    df = df[lambda x : x.latitude!='Not available']
-    df = df[lambda x : x.latitude.astype(float)>10]
-    df = df[lambda x : x.latitude.astype(float)<30]
+    # Missing coordinates are NaN and fail the range check
+    df = df[lambda x : (x.latitude>10) & (x.latitude<30)]
     return df
     
 def get_fx_rates():
@@ -224,21 +368,29 @@ def get_fx_rates():
     else:
         print(f"Error: {response.status_code} - {response.text}")
         
+@st.cache_resource
+def render_cache():
+    """Rendered maps and figures shared by all sessions, see `RenderCache`."""
+    return RenderCache(setting('dashboard', 'render_cache_mb') * 1024 ** 2)
+
+@functools.lru_cache(maxsize=1)
+def district_geometry():
+    """District rings ([lon, lat]) at every zoom level, read from the preprocessed cache, see `load_geometry`."""
+    return load_geometry()
+
 def coordinates_map_districts():
-    with open("data_coordinates_map.json", "r") as f:
-        coordinates_map = json.load(f)
-    return coordinates_map
+    return district_geometry()[FULL_RESOLUTION]
 
 def transform_fx_rates(fx_rates_dict):
     fx_rates_dict['KRW(K)']=fx_rates_dict['KRW']/1000
     del fx_rates_dict['KRW']
     return fx_rates_dict
 
-def distance_to_office(df):
-    return [geodesic(OFFICE_COORD, (float(df.iloc[i]['latitude']), float(df.iloc[i]['longitude']))).kilometers for i in range(len(df)) ]
+def distance_to_office(df, office=OFFICE_COORD, method='geodesic'):
+    return distances_from(office, df['latitude'], df['longitude'], method)
 
-def transit_url(df):
-    return [citymapper_url_from_coords(OFFICE_COORD, (float(df.iloc[i]['latitude']), float(df.iloc[i]['longitude']))) for i in range(len(df)) ]
+def transit_url(df, office=OFFICE_COORD):
+    return citymapper_urls(office, df['latitude'], df['longitude'])
 
 def citymapper_url_from_coords(start_coords, end_coords):
     """
@@ -1,13 +1,10 @@
 import pandas as pd
 import logging
-import streamlit as st
+import time
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
-
-SUPABASE_URL = st.secrets["database"]["SUPABASE_URL"]
-SUPABASE_KEY = st.secrets["database"]["SUPABASE_KEY"]
-
-# Initialize Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+from config import setting
+from schema import normalize
 
 # Set up logging
 logging.basicConfig(
@@ -16,9 +13,53 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s",
 )
 
+IN_BATCH_SIZE = 500  # Keys per `in` filter, keeps the request URL short
+
+def _json_frame(df):
+    """DataFrame with JSON-compatible values: dates as ISO 8601 strings and missing values as None."""
+    df = df.copy()
+    for column in df.columns[[pd.api.types.is_datetime64_any_dtype(dtype) for dtype in df.dtypes]]:
+        df[column] = df[column].map(lambda value: value.isoformat(), na_action='ignore')
+    return df.astype(object).where(df.notna(), None)
+
+def _records(df):
+    """DataFrame rows as JSON-compatible dicts, with missing values sent as null."""
+    return _json_frame(df).to_dict(orient="records")
+
+def _select(columns):
+    """PostgREST select list of `columns`, quoted: postgrest-py strips the spaces of unquoted names."""
+    return ",".join(f'"{column}"' for column in columns) if columns else "*"
+
+def create_supabase_client() -> Client:
+    """Create the Supabase client from the [database] settings (env or TOML)."""
+    supabase_url = setting("database", "SUPABASE_URL")
+    supabase_key = setting("database", "SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        raise RuntimeError("SUPABASE_URL and SUPABASE_KEY must be set in the environment or a TOML config file")
+    return create_client(supabase_url, supabase_key)
+
 class SupabaseDatabase:
-    def __init__(self, client):
-        self.client = client
+    """
+    Access to the Supabase tables.
+
+    Reads are paginated with parallel `range()` requests of `page_size` rows,
+    so they are not truncated by PostgREST's max-rows limit; writes are sent
+    in batches of `batch_size` rows. Both use up to `max_workers` concurrent
+    requests.
+    """
+
+    def __init__(self, client=None, page_size=1000, batch_size=500, max_workers=4):
+        self._client = client
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+
+    @property
+    def client(self):
+        """The Supabase client, created on first use so importing this module needs no credentials."""
+        if self._client is None:
+            self._client = create_supabase_client()
+        return self._client
 
     def save_data(self, df, table_name):
         """Delete existing records and save a DataFrame to a Supabase table."""
@@ -33,36 +74,224 @@ class SupabaseDatabase:
         
     
             logging.info(f"Saving {len(df)} new records to '{table_name}' table.")
-            data = df.to_dict(orient="records")  # Convert DataFrame to list of dictionaries
-            insert_response = self.client.table(table_name).insert(data).execute()
+            inserted = self._write_batches(table_name, _records(df), lambda table, batch: table.insert(batch))
             
-            if insert_response.data:
-                logging.info(f"Successfully saved {len(insert_response.data)} new records to '{table_name}'.")
+            if inserted:
+                logging.info(f"Successfully saved {inserted} new records to '{table_name}'.")
             else:
-                logging.warning(f"No records inserted into '{table_name}'. Response: {insert_response}")
+                logging.warning(f"No records inserted into '{table_name}'.")
     
         except Exception as e:
             logging.error(f"Error in save_data for '{table_name}': {e}")
 
-    def load_data(self, table_name):
-        """Load data from a specified Supabase table."""
+    def append_data(self, df, table_name):
+        """Insert the rows of a DataFrame into a Supabase table, keeping existing records."""
+        if df.empty:
+            logging.info(f"No new records to append to '{table_name}'.")
+            return
         try:
-            logging.info(f"Loading data from '{table_name}' table.")
-            response = self.client.table(table_name).select("*").execute()
-            
-            if response.data:
-                df = pd.DataFrame(response.data)
-                logging.info(f"Successfully loaded {len(df)} records from '{table_name}'.")
-                return df
+            logging.info(f"Appending {len(df)} records to '{table_name}' table.")
+            inserted = self._write_batches(table_name, _records(df), lambda table, batch: table.insert(batch))
+
+            if inserted:
+                logging.info(f"Successfully appended {inserted} records to '{table_name}'.")
             else:
-                logging.warning(f"No data found in '{table_name}'.")
-                return pd.DataFrame()
-        
+                logging.warning(f"No records appended to '{table_name}'.")
+
+        except Exception as e:
+            logging.error(f"Error in append_data for '{table_name}': {e}")
+
+    def upsert_data(self, df, table_name, key_columns):
+        """
+        Write the rows of a DataFrame over the records with the same `key_columns` values, in batches.
+
+        The upsert conflicts on `key_columns`, which need a unique constraint,
+        see migrations/.
+        """
+        if df.empty:
+            return
+        try:
+            logging.info(f"Upserting {len(df)} records into '{table_name}' on {key_columns}.")
+            on_conflict = ",".join(key_columns)
+            upserted = self._write_batches(table_name, _records(df), lambda table, batch: table.upsert(batch, on_conflict=on_conflict))
+            logging.info(f"Successfully upserted {upserted} records into '{table_name}'.")
+        except Exception as e:
+            logging.error(f"Error in upsert_data for '{table_name}': {e}")
+
+    def delete_keys(self, keys, table_name, key_columns):
+        """Delete the records whose `key_columns` values appear in the `keys` DataFrame."""
+        if keys.empty:
+            return
+        try:
+            logging.info(f"Deleting {len(keys)} records from '{table_name}'.")
+            if len(key_columns) == 1:
+                values = keys[key_columns[0]].tolist()
+                for i in range(0, len(values), IN_BATCH_SIZE):
+                    self.client.table(table_name).delete().in_(key_columns[0], values[i:i + IN_BATCH_SIZE]).execute()
+            else:
+                for key in _records(keys[key_columns]):
+                    self.client.table(table_name).delete().match(key).execute()
+        except Exception as e:
+            logging.error(f"Error in delete_keys for '{table_name}': {e}")
+
+    def sync_data(self, df, table_name, key_columns, delete_missing=True, compare_columns=None, schema=None):
+        """
+        Make a Supabase table match a DataFrame by sending only the differences.
+
+        Stored rows are diffed against `df` on `key_columns`: new keys are
+        inserted, rows whose other columns changed are upserted in batches
+        (see `upsert_data`) and, with `delete_missing`, stored keys absent
+        from `df` are deleted. Unlike `save_data`, the table is never emptied,
+        so readers always see a complete table. The stored rows are read with
+        `fetch_data`: a failed read raises rather than passing for an empty
+        table, whose rows would all be inserted again. `compare_columns` limits
+        which columns are checked for changes (default: all columns present on
+        both sides); pass [] when stored rows never need updating. With a
+        `schema`, stored rows are normalized with it before the comparison, so
+        values stored as text by older versions match their typed counterpart.
+
+        Returns:
+            dict: Number of inserted, updated and deleted records.
+        """
+        if delete_missing and df.empty:
+            raise ValueError(f"Refusing to sync '{table_name}' from an empty DataFrame, it would delete every record")
+        # Only the compared columns are downloaded
+        stored = self.fetch_data(table_name, columns=key_columns + list(compare_columns) if compare_columns is not None else None)
+        df = df.drop_duplicates(subset=key_columns, keep='first')
+        if stored.empty:
+            self.append_data(df, table_name)
+            return {'inserted': len(df), 'updated': 0, 'deleted': 0}
+
+        # Values are compared in their JSON form, as strings
+        if compare_columns is None:
+            compare_columns = [c for c in df.columns if c in stored.columns and c not in key_columns]
+        columns = key_columns + list(compare_columns)
+        stored_typed = normalize(stored[columns], schema) if schema else stored[columns]
+        new = _json_frame(df[columns]).astype(str).set_index(key_columns)
+        stored_str = _json_frame(stored_typed).astype(str)
+        old = stored_str.drop_duplicates(subset=key_columns).set_index(key_columns)
+
+        is_new = ~new.index.isin(old.index)
+        common = new.index[~is_new]
+        changed = (new.loc[common] != old.loc[common]).any(axis=1) if len(new.columns) else pd.Series(False, index=common)
+        is_changed = new.index.isin(changed[changed].index)
+
+        inserts = df[is_new]
+        updates = df[is_changed]
+        deletes = old.index[~old.index.isin(new.index)].to_frame(index=False) if delete_missing else pd.DataFrame()
+        # The key values of `deletes` are strings, use the stored ones
+        if delete_missing and not deletes.empty:
+            is_deleted = pd.MultiIndex.from_frame(stored_str[key_columns]).isin(pd.MultiIndex.from_frame(deletes))
+            deletes = stored.loc[is_deleted, key_columns].drop_duplicates()
+
+        logging.info(f"Syncing '{table_name}': {len(inserts)} inserts, {len(updates)} updates, {len(deletes)} deletes.")
+        self.append_data(inserts, table_name)
+        self.upsert_data(updates, table_name, key_columns)
+        self.delete_keys(deletes, table_name, key_columns)
+        return {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deletes)}
+
+    def _write_batches(self, table_name, records, write):
+        """
+        Send `records` in batches of `batch_size`, with up to `max_workers` requests in flight.
+
+        `write(table, batch)` builds the request of a batch. Returns the number
+        of records acknowledged; a failed batch raises once all batches ended.
+        """
+        batches = [records[i:i + self.batch_size] for i in range(0, len(records), self.batch_size)]
+
+        def send(i, batch):
+            start = time.perf_counter()
+            response = write(self.client.table(table_name), batch).execute()
+            logging.info(f"'{table_name}' batch {i + 1}/{len(batches)}: {len(batch)} records in {time.perf_counter() - start:.2f}s.")
+            return len(response.data or [])
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(send, i, batch) for i, batch in enumerate(batches)]
+            return sum(future.result() for future in futures)
+
+    def count_rows(self, table_name, order_by="id", after=None):
+        """Return the number of records in a table, only those with `order_by` > `after` if given."""
+        query = self.client.table(table_name).select("*", count="exact", head=True)
+        if after is not None:
+            query = query.gt(order_by, after)
+        return query.execute().count or 0
+
+    def load_data(self, table_name, columns=None, order_by="id", after=None):
+        """
+        Load data from a specified Supabase table, see `fetch_data`.
+
+        Errors are logged and give an empty DataFrame, for the readers that can
+        carry on without the table (the dashboard snapshots).
+        """
+        try:
+            return self.fetch_data(table_name, columns, order_by, after)
         except Exception as e:
             logging.error(f"Error loading from '{table_name}': {e}")
             return pd.DataFrame()
 
+    def fetch_data(self, table_name, columns=None, order_by="id", after=None):
+        """
+        Load data from a specified Supabase table, raising on any request error.
+
+        Pages of `page_size` rows, ordered by `order_by`, are requested in
+        parallel with `range()`. A page cut short by the server's max-rows
+        limit is completed from where it stopped. `columns` restricts the download to those
+        columns (default: all) and `after` to the rows whose `order_by` value
+        is greater, for delta loads.
+        """
+        logging.info(f"Loading data from '{table_name}' table.")
+        start = time.perf_counter()
+        select = _select(columns)
+        total = self.count_rows(table_name, order_by, after)
+
+        def load_page(offset):
+            page_start = time.perf_counter()
+            size = min(self.page_size, total - offset)
+            rows = []
+            while len(rows) < size:
+                query = self.client.table(table_name).select(select)
+                if after is not None:
+                    query = query.gt(order_by, after)
+                data = query.order(order_by).range(offset + len(rows), offset + size - 1).execute().data
+                if not data:
+                    break  # Rows deleted since they were counted
+                rows.extend(data)
+            logging.info(f"'{table_name}' rows {offset}-{offset + len(rows) - 1}: "
+                         f"{len(rows)} records in {time.perf_counter() - page_start:.2f}s.")
+            return rows
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pages = list(executor.map(load_page, range(0, total, self.page_size)))
+        data = [row for page in pages for row in page]
+
+        if data:
+            df = pd.DataFrame(data)
+            logging.info(f"Successfully loaded {len(df)} records from '{table_name}' in {time.perf_counter() - start:.2f}s.")
+            return df
+        else:
+            logging.warning(f"No data found in '{table_name}'.")
+            return pd.DataFrame()
+
+    def load_ids(self, table_name, ids, columns=None):
+        """Load the records of a table whose `id` is in `ids`."""
+        try:
+            select = _select(columns)
+            ids = list(ids)
+            batches = [ids[i:i + IN_BATCH_SIZE] for i in range(0, len(ids), IN_BATCH_SIZE)]
+
+            def load_batch(batch):
+                return self.client.table(table_name).select(select).in_("id", batch).execute().data
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                data = [row for rows in executor.map(load_batch, batches) for row in rows]
+            logging.info(f"Loaded {len(data)} records by id from '{table_name}'.")
+            return pd.DataFrame(data)
+
+        except Exception as e:
+            logging.error(f"Error loading ids from '{table_name}': {e}")
+            return pd.DataFrame()
+
 # Instantiate the Supabase database object
-db = SupabaseDatabase(supabase)
+db = SupabaseDatabase()
 
 
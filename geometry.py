@@ -0,0 +1,140 @@
+import json
+import os
+import zipfile
+import numpy as np
+
+COORDINATES_MAP_PATH = "data_coordinates_map.json"
+GEOMETRY_CACHE_PATH = "data_coordinates_map.npz"
+
+# Douglas-Peucker tolerance (degrees) per map zoom level, about half a screen
+# pixel at that zoom; the last level keeps every vertex
+SIMPLIFY_TOLERANCES = {10: 0.0007, 12: 0.00017, 14: 0.00004, 18: 0.0}
+FULL_RESOLUTION = 18
+
+# Rounding of the stored coordinates, about 1 m
+COORDINATE_DECIMALS = 5
+
+
+def douglas_peucker(points, tolerance):
+    """
+    Mask of the vertices of a polyline kept by Douglas-Peucker simplification.
+
+    The end points are always kept. A closed ring (first point == last) is
+    split at its vertex farthest from the start, so it simplifies like two
+    open polylines.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        chord = points[end] - points[start]
+        inner = points[start + 1:end] - points[start]
+        length = np.hypot(chord[0], chord[1])
+        if length == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            distances = np.abs(chord[0] * inner[:, 1] - chord[1] * inner[:, 0]) / length
+        farthest = np.argmax(distances)
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.extend([(start, split), (split, end)])
+    return keep
+
+
+def simplify_ring(ring, tolerance):
+    """Simplified closed ring, the original one if simplifying would leave less than a triangle."""
+    if tolerance <= 0:
+        return ring
+    simplified = ring[douglas_peucker(ring, tolerance)]
+    return simplified if len(simplified) >= 4 else ring
+
+
+def build_geometry(coordinates_map):
+    """
+    Rings of every district at each zoom level of SIMPLIFY_TOLERANCES.
+
+    Returns:
+        dict: zoom -> {name: (n, 2) array of [lon, lat] vertices}, the order of
+        data_coordinates_map.json and of GeoJSON.
+    """
+    rings = {name: np.asarray(ring, dtype=float) for name, ring in coordinates_map.items()}
+    return {zoom: {name: simplify_ring(ring, tolerance).round(COORDINATE_DECIMALS) for name, ring in rings.items()}
+            for zoom, tolerance in SIMPLIFY_TOLERANCES.items()}
+
+
+def _settings():
+    """SIMPLIFY_TOLERANCES and COORDINATE_DECIMALS as one array, as stored in the cache."""
+    return np.array([[zoom, tolerance] for zoom, tolerance in SIMPLIFY_TOLERANCES.items()] + [[-1, COORDINATE_DECIMALS]])
+
+
+def save_geometry(geometry, path=GEOMETRY_CACHE_PATH):
+    """
+    Store the geometry as one vertex array and ring offsets per zoom level.
+
+    The file is written under a temporary name then renamed, so readers never
+    see it half-written. The tolerances and rounding it was built with are
+    stored along, see `read_geometry`.
+    """
+    names = list(geometry[FULL_RESOLUTION])
+    arrays = {'names': np.array(names), 'settings': _settings()}
+    for zoom, rings in geometry.items():
+        arrays[f'vertices_{zoom}'] = np.concatenate([rings[name] for name in names])
+        arrays[f'offsets_{zoom}'] = np.cumsum([0] + [len(rings[name]) for name in names])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_geometry(path=GEOMETRY_CACHE_PATH):
+    """Geometry stored by `save_geometry`; ValueError if it was built with other settings."""
+    with np.load(path) as arrays:
+        if not np.array_equal(arrays['settings'], _settings()):
+            raise ValueError(f"{path} was built with other tolerances")
+        names = arrays['names'].tolist()
+        geometry = {}
+        for zoom in SIMPLIFY_TOLERANCES:
+            vertices, offsets = arrays[f'vertices_{zoom}'], arrays[f'offsets_{zoom}']
+            geometry[zoom] = {name: vertices[offsets[i]:offsets[i + 1]] for i, name in enumerate(names)}
+    return geometry
+
+
+def load_geometry(json_path=COORDINATES_MAP_PATH, cache_path=GEOMETRY_CACHE_PATH):
+    """
+    District rings at every zoom level, from the cache file.
+
+    The cache is rebuilt from the JSON map when it is missing, older than
+    the JSON, made with other tolerances or unreadable.
+    """
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(json_path):
+        try:
+            return read_geometry(cache_path)
+        except (KeyError, ValueError, EOFError, OSError, zipfile.BadZipFile):
+            pass
+    with open(json_path, "r") as f:
+        geometry = build_geometry(json.load(f))
+    save_geometry(geometry, cache_path)
+    return geometry
+
+
+def district_geojson(rings, properties):
+    """
+    GeoJSON FeatureCollection of the districts with properties.
+
+    Parameters:
+        rings (dict): name -> [lon, lat] ring, one zoom level of `load_geometry`.
+        properties (dict): name -> dict of feature properties; only these districts are included.
+    """
+    features = [
+        {
+            'type': 'Feature',
+            'properties': {'name': name, **district_properties},
+            'geometry': {'type': 'Polygon', 'coordinates': [rings[name].tolist()]},
+        }
+        for name, district_properties in properties.items() if name in rings
+    ]
+    return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,74 @@
+"""
+Command-line entry point running the data refresh without Streamlit.
+
+    python -m hk_housing refresh [--phase listings|details|history|all] [--incremental] [--restart]
+    python -m hk_housing cube [--rebuild | --verify]
+
+Settings come from the environment and TOML files, see config.py. Meant to
+be run from cron on a worker box, e.g. hourly incremental listings and a
+nightly full refresh. Each command keeps its own checkpoints: rerunning an
+interrupted command resumes it, whatever ran in between. Refreshes never
+overlap, a command started while another one runs exits without doing
+anything:
+
+    0 * * * *  cd /srv/hk_housing && python -m hk_housing refresh --phase listings --incremental && python -m hk_housing refresh --phase details
+    30 3 * * * cd /srv/hk_housing && python -m hk_housing refresh --phase all
+"""
+import argparse
+import datetime
+import logging
+import sys
+from progress import LoggingProgress
+from refresh_job import PHASES, RefreshJob
+
+
+def refresh(args):
+    now_dt = datetime.datetime.now(tz=datetime.timezone.utc)
+    now_hr_ts = (now_dt.timestamp() // 3600) * 3600
+    phases = PHASES if args.phase == 'all' else (args.phase,)
+    job = RefreshJob(progress=LoggingProgress())
+    # Each command is its own job with its own checkpoints, rerunning it resumes it
+    job.run(now_hr_ts, phases=phases, full_sweep=not args.incremental, restart=args.restart)
+
+
+def cube(args):
+    # The dashboard modules import Streamlit, only load them for this command
+    from aggregates import IncrementalCube
+    from data import HISTORY_CUBE, process_data_history
+    from snapshot_store import SnapshotStore
+    store = SnapshotStore()
+    df_history = process_data_history(store.load("property_listing_history"))
+    history_cube = IncrementalCube(store, HISTORY_CUBE)
+    if args.rebuild:
+        history_cube.rebuild(df_history)
+    else:
+        history_cube.update(df_history)
+    if args.verify and not history_cube.verify(df_history):
+        logging.error("The incremental history cube differs from a rebuild, run with --rebuild.")
+        sys.exit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="hk_housing", description="Hong Kong rental listings data tools.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    refresh_parser = subparsers.add_parser('refresh', help="Scrape 28hse and refresh the Supabase tables, resuming an interrupted run.")
+    refresh_parser.add_argument('--phase', choices=PHASES + ('all',), default='all', help="Phase to run (default: all)")
+    refresh_parser.add_argument('--incremental', action='store_true', help="Only crawl index pages until known listings are reached")
+    refresh_parser.add_argument('--restart', action='store_true', help="Drop the checkpoints of an unfinished run")
+    refresh_parser.set_defaults(func=refresh)
+
+    cube_parser = subparsers.add_parser('cube', help="Update the history statistics cube from the new leases of the snapshot.")
+    cube_mode = cube_parser.add_mutually_exclusive_group()
+    cube_mode.add_argument('--rebuild', action='store_true', help="Recompute the cube from the whole history")
+    cube_mode.add_argument('--verify', action='store_true', help="Check the updated cube against a rebuild")
+    cube_parser.set_defaults(func=cube)
+
+    args = parser.parse_args(argv)
+    # Progress goes to the console as well as to property_log.log
+    logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,13 +6,13 @@ from style_and_plot import *
 now_dt = datetime.datetime.now(tz=datetime.timezone.utc)
 now_hr_ts = (now_dt.timestamp() // 3600) * 3600
 
-#update_database(now_hr_ts)
+# The refresh runs outside the dashboard: python -m hk_housing refresh (see README)
 
 # Add a button to trigger the update
 # if st.sidebar.button("Update Database"):
 #     with st.spinner("Updating database..."):
 #         try:
-#             update_database(now_hr_ts)
+#             update_database(now_hr_ts, progress=StreamlitProgress())
 #             st.success("Database updated successfully!")
 #         except Exception as e:
 #             st.error(f"Error updating database: {e}")
@@ -26,16 +26,33 @@ st.markdown(
     {str(update_dt)[:16]} UTC."""
 )
 
-df_province = df_history[['province', 'lease_year', 'unit_price']].dropna().groupby(['province','lease_year']).mean().unstack()['unit_price']
-df_area_district = df_history[['area_district', 'lease_year', 'unit_price']].dropna().groupby(['area_district','lease_year']).mean().unstack()['unit_price']
-df_area = df_history[['area', 'lease_year', 'unit_price']].dropna().groupby(['area','lease_year']).mean().unstack()['unit_price']
-df_listing['historical_average'] = [df_area_district.mean(axis=1).loc[distric] for distric in df_listing['area_district']]
+# Statistics by geography, year and rooms are precomputed once per data load
+cubes = aggregate_cubes(now_hr_ts)
+df_province = cube_table(cubes['history'], 'province')
+df_area_district = cube_table(cubes['history'], 'area_district')
+df_area = cube_table(cubes['history'], 'area')
+# Unit price expected from comparable past leases, computed once per data load
+df_listing = df_listing.join(listing_valuations(now_hr_ts))
 df_listing['unit_price_vs_histo']=df_listing['unit_price']/df_listing['historical_average']-1
 
+# Maps and figures already rendered for the same data and parameters are reused
+renders = render_cache()
+
 add_sidebar = st.sidebar.selectbox('Listing Search or District Statistics', ('Listing Search', 'Districts Statistics'))
 st.title("Hong Kong Property Map")
 
 if add_sidebar == 'Listing Search':
+    # Commute anchors; distances to them are computed once per data load and anchor set
+    st.sidebar.subheader("Commute anchors")
+    df_anchors = st.sidebar.data_editor(
+        pd.DataFrame([{'name': name, 'latitude': lat, 'longitude': lon, 'weight': 1.0} for name, lat, lon in default_anchors()]),
+        num_rows="dynamic",
+        key="anchors"
+    )
+    df_anchors = df_anchors.dropna(subset=['name', 'latitude', 'longitude']).drop_duplicates(subset='name')
+    anchors = tuple((str(name), float(lat), float(lon)) for name, lat, lon in df_anchors[['name', 'latitude', 'longitude']].itertuples(index=False))
+    df_anchor_distances = anchor_distances(now_hr_ts, anchors)
+
     # Initialize session state for all currencies
     for currency in fx_rates.keys():
         if currency not in st.session_state:
@@ -101,7 +118,7 @@ if add_sidebar == 'Listing Search':
         # Input widgets
         numbers_of_rooms = st.multiselect(
         "Number of Rooms", 
-        options=sorted(set(df_listing["number_of_rooms"])),  # Sorted list of unique room numbers
+        options=sorted(df_listing["number_of_rooms"].dropna().unique()),  # Sorted list of unique room numbers
         default=['2','3']
         )
         price_range = st.slider(
@@ -111,8 +128,12 @@ if add_sidebar == 'Listing Search':
             value=(0, 50_000),
             step=1000
         )
+        distance_mode = st.selectbox(
+            "Distance to anchors",
+            options=['Closest anchor', 'Farthest anchor', 'Weighted average']
+        )
         distance_range = st.slider(
-            "Select a distance to office", 
+            "Select a distance to anchors (km)", 
             min_value=0, 
             max_value=50, 
             value=(0, 20),
@@ -132,27 +153,29 @@ if add_sidebar == 'Listing Search':
         submitted = st.form_submit_button("Submit")
     
     if submitted:
-        filtered_df = df_listing[
-            (df_listing["lease_price"] >= price_range[0]) & 
-            (df_listing["lease_price"] <= price_range[1]) &
-            (df_listing["floor_size"] >= floor_size_range[0]) &
-            (df_listing["floor_size"] <= floor_size_range[1]) &
-            (df_listing["distance_to_office_km"] >= distance_range[0]) &
-            (df_listing["distance_to_office_km"] <= distance_range[1]) 
-        ]
-        if numbers_of_rooms:  # Check if the user selected any values
-            filtered_df = filtered_df[filtered_df["number_of_rooms"].isin(numbers_of_rooms)]
-            
-        if 'ALL' not in province_choice:
-            filtered_df = filtered_df[filtered_df["province"].isin(province_choice)]
-        if 'ALL' not in area_choice:
-            filtered_df = filtered_df[filtered_df["area"].isin(area_choice)]
+        df_listing = df_listing.join(df_anchor_distances)
+        how = {'Closest anchor': 'min', 'Farthest anchor': 'max', 'Weighted average': 'weighted'}[distance_mode]
+        weights = tuple(df_anchors['weight'].fillna(0).clip(lower=0)) if how == 'weighted' else ()
+        # Indexed per data load and anchor setting, answers are memoized per filter
+        engine = listing_query_engine(now_hr_ts, anchors, how, weights if sum(weights) > 0 else None)
+        df_listing['distance_km'] = engine.values['distance_km']
+        positions = engine.query(
+            ranges={'lease_price': price_range, 'floor_size': floor_size_range, 'distance_km': distance_range},
+            categories={
+                'number_of_rooms': numbers_of_rooms or None,
+                'province': None if 'ALL' in province_choice else province_choice,
+                'area': None if 'ALL' in area_choice else area_choice,
+            }
+        )
+        filtered_df = df_listing.iloc[positions]
+        filter_spec = (anchors, how, weights, price_range, floor_size_range, distance_range,
+                       tuple(numbers_of_rooms), tuple(province_choice), tuple(area_choice))
     
         if show_map:
-            plot_map(filtered_df)
+            plot_map(filtered_df, cache=renders, cache_key=render_key(now_hr_ts, 'listing_map', filter_spec))
         st.header('Listing list')
         st.markdown(f'number of properties : {len(filtered_df)}')
-        df_print = style_dataframe(filtered_df.set_index('property_number').sort_values('unit_price_vs_histo')[DISPLAY_COLUMNS])
+        df_print = style_dataframe(filtered_df.set_index('property_number').sort_values('unit_price_vs_histo')[DISPLAY_COLUMNS + list(df_anchor_distances.columns)])
         st.dataframe(df_print)
         
         # Function to convert URLs to Markdown format
@@ -167,9 +190,20 @@ if add_sidebar == 'Listing Search':
         st.markdown(f'details:')
         st.write(filtered_df[SHORT_DISPLAY_COLUMNS].sort_values('unit_price_vs_histo').to_html(escape=False, index=False), unsafe_allow_html=True)
 
+    # Past leases around a listing, from the spatial index of the history
+    st.header('Leases near a listing')
+    nearby_property = st.selectbox("Property number", options=df_listing['property_number'].tolist())
+    radius_m = st.slider("Radius (m)", min_value=100, max_value=2000, value=500, step=100)
+    listing = df_listing[df_listing['property_number'] == nearby_property].iloc[0]
+    nearby = spatial_indexes(now_hr_ts)['history'].within_radius(listing['latitude'], listing['longitude'], radius_m / 1000)
+    df_nearby = df_history.loc[nearby.index].assign(distance_km=nearby.values)
+    st.markdown(f'{len(df_nearby)} leases within {radius_m} m of {listing["address"]}')
+    st.dataframe(df_nearby[['address', 'Flat Name', 'lease_date', 'lease_price', 'floor_size', 'unit_price', 'Rooms', 'distance_km']])
+
 if add_sidebar == 'Districts Statistics':
     st.header('Current listings average price lease (HKD/SF)')
-    plot_map_color(df_listing, coordinates_map)
+    plot_map_color(cube_range(cubes['listing'], 'area_district'), district_geometry(),
+                   cache=renders, cache_key=render_key(now_hr_ts, 'listing_district_map'))
     
     st.header('History listings average price lease (HKD/SF)')
     date_range = st.slider(
@@ -183,13 +217,24 @@ if add_sidebar == 'Districts Statistics':
             (df_history["lease_date"] >= date_range[0].isoformat()) & 
             (df_history["lease_date"] <= date_range[1].isoformat()) 
         ]
-    plot_map_color(df_history_filtered, coordinates_map)
+    plot_map_color(cube_range(cubes['history'], 'area_district', *date_range), district_geometry(),
+                   cache=renders, cache_key=render_key(now_hr_ts, 'history_district_map', date_range))
     st.dataframe(df_history_filtered)
     
     
+    # The heatmap draws every district in one trace, the bars one subplot each
+    evolution_chart = st.radio("Price evolution chart", ["Heatmap", "Bars per district"], horizontal=True)
+    plot_evolution = plot_unit_price_heatmap if evolution_chart == "Heatmap" else plot_unit_price_evolution
     st.subheader("Price Evolution by province")
-    fig_1 = plot_unit_price_evolution(df_province,'province')
+    fig_1 = cached_figure(renders, render_key(now_hr_ts, 'price_evolution', 'province', evolution_chart), lambda: plot_evolution(df_province,'province'))
     st.plotly_chart(fig_1)
     st.subheader("Price Evolution by district")
-    fig_2 = plot_unit_price_evolution(df_area_district,'area_district')
+    fig_2 = cached_figure(renders, render_key(now_hr_ts, 'price_evolution', 'area_district', evolution_chart), lambda: plot_evolution(df_area_district,'area_district'))
     st.plotly_chart(fig_2)    
+
+# Render cache counters, shared by all sessions
+render_stats = renders.stats()
+st.sidebar.caption(
+    f"Render cache: {render_stats['hits']} hits, {render_stats['misses']} misses "
+    f"({render_stats['hit_rate']:.0%}), {render_stats['bytes'] / 1024 ** 2:.1f} MB"
+)
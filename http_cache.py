@@ -0,0 +1,125 @@
+import sqlite3
+import threading
+import time
+import zlib
+
+# Seconds during which a cached response is served without contacting the site.
+# Past that, the response is revalidated with a conditional GET.
+DEFAULT_TTLS = {
+    'index': 0,  # Listing index pages change every hour, always revalidate
+    'detail': 24 * 3600,
+    'history': 12 * 3600,
+    'other': 0,
+}
+
+
+def url_class(url):
+    """Classify a 28hse URL as 'index', 'detail', 'history' or 'other'."""
+    if '/transaction/rent' in url:
+        return 'history'
+    if '/property-' in url:
+        return 'detail'
+    if '/rent/residential' in url:
+        return 'index'
+    return 'other'
+
+
+class ResponseCache:
+    """
+    Persistent HTTP response cache keyed by URL, stored in a SQLite file.
+
+    Bodies are stored compressed together with their ETag and Last-Modified
+    headers. Fresh entries (younger than the TTL of their URL class) are
+    served as is; stale entries are revalidated with If-None-Match /
+    If-Modified-Since, so unchanged pages come back as a bodyless 304.
+
+    Parameters:
+        path (str): Path of the SQLite file.
+        ttls (dict): TTL in seconds per URL class, merged over DEFAULT_TTLS.
+    """
+
+    def __init__(self, path="http_cache.sqlite", ttls=None):
+        self.path = path
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.counters = {'hits': 0, 'revalidated': 0, 'misses': 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "url TEXT PRIMARY KEY, body BLOB, etag TEXT, last_modified TEXT, fetched_at REAL)"
+        )
+        self._conn.commit()
+
+    def lookup(self, url):
+        """Return the cached entry of `url` as a dict, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag, last_modified, fetched_at FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        body, etag, last_modified, fetched_at = row
+        return {
+            'body': zlib.decompress(body).decode('utf-8'),
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': fetched_at,
+        }
+
+    def is_fresh(self, url, entry):
+        return time.time() - entry['fetched_at'] < self.ttls[url_class(url)]
+
+    def conditional_headers(self, entry):
+        """Headers turning a request into a conditional GET against `entry`."""
+        headers = {}
+        if entry is None:
+            return headers
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, body, etag=None, last_modified=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (url, zlib.compress(body.encode('utf-8')), etag, last_modified, time.time()),
+            )
+            self._conn.commit()
+
+    def touch(self, url):
+        """Mark an entry as fresh again after a 304 Not Modified."""
+        with self._lock:
+            self._conn.execute("UPDATE responses SET fetched_at = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+
+    def prune(self, max_age):
+        """
+        Delete the entries not fetched or revalidated for `max_age` seconds,
+        such as the pages of delisted properties, and shrink the file.
+
+        Returns the number of entries deleted.
+        """
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM responses WHERE fetched_at < ?", (time.time() - max_age,)).rowcount
+            self._conn.commit()
+            if deleted:
+                self._conn.execute("VACUUM")
+        return deleted
+
+    def record(self, outcome):
+        with self._lock:
+            self.counters[outcome] += 1
+
+    def stats(self):
+        """Return hit/revalidation/miss counters and the overall hit ratio."""
+        with self._lock:
+            counters = dict(self.counters)
+        total = sum(counters.values())
+        counters['hit_ratio'] = (counters['hits'] + counters['revalidated']) / total if total else 0.0
+        return counters
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Columns of the "Filter Housing" form
+CATEGORICAL_COLUMNS = ('province', 'area', 'number_of_rooms')
+RANGE_COLUMNS = ('lease_price', 'floor_size', 'distance_km', 'distance_to_office_km')
+
+# Filter specs whose answer is kept
+QUERY_CACHE_SIZE = 256
+
+
+class ListingQueryEngine:
+    """
+    Indexes over the listings answering the filters of the dashboard form.
+
+    Each categorical column is stored as codes with a posting list (sorted
+    row positions) per value, each range column as its values with the
+    positions sorting them, so a predicate gives its matching rows through
+    a lookup or two binary searches instead of a pass over every listing.
+    A query starts from the smallest of these candidate sets and checks the
+    other predicates on it only. Answers are memoized by filter spec, under
+    a lock: the engine is shared by the Streamlit sessions, which run in
+    threads.
+
+    Queries return row positions in the indexed frame, in its order.
+    """
+
+    def __init__(self, df, categorical_columns=CATEGORICAL_COLUMNS, range_columns=RANGE_COLUMNS):
+        self.size = len(df)
+        self.codes, self.labels, self.postings = {}, {}, {}
+        for column in categorical_columns:
+            codes, uniques = pd.factorize(df[column].astype(object))
+            order = np.argsort(codes, kind='stable')
+            # Rows of value i are at order[offsets[i]:offsets[i + 1]], missing values (-1) come first
+            offsets = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            self.codes[column] = codes
+            self.labels[column] = {label: i for i, label in enumerate(uniques)}
+            self.postings[column] = (order, offsets)
+        self.values, self.sorted_values = {}, {}
+        for column in range_columns:
+            values = df[column].to_numpy(dtype=float)
+            order = np.argsort(values, kind='stable')  # Missing values sort last
+            self.values[column] = values
+            self.sorted_values[column] = (values[order], order)
+        self._answers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def query(self, ranges=None, categories=None):
+        """
+        Positions of the rows matching every predicate.
+
+        Parameters:
+            ranges (dict): column -> (low, high), inclusive bounds.
+            categories (dict): column -> accepted values; None means no
+                filter on the column, an empty selection matches nothing.
+
+        Returns:
+            numpy.ndarray: Sorted row positions, read-only.
+        """
+        ranges = {column: bounds for column, bounds in (ranges or {}).items() if bounds is not None}
+        categories = {column: values for column, values in (categories or {}).items() if values is not None}
+        key = (tuple(sorted((column, tuple(bounds)) for column, bounds in ranges.items())),
+               tuple(sorted((column, tuple(sorted(set(values), key=str))) for column, values in categories.items())))
+        with self._lock:
+            if key in self._answers:
+                self._answers.move_to_end(key)
+                return self._answers[key]
+
+        positions = self._query(ranges, categories)
+        positions.setflags(write=False)
+        with self._lock:
+            self._answers[key] = positions
+            if len(self._answers) > QUERY_CACHE_SIZE:
+                self._answers.popitem(last=False)
+        return positions
+
+    def _query(self, ranges, categories):
+        candidates = {}
+        for column, (low, high) in ranges.items():
+            values, order = self.sorted_values[column]
+            candidates[('range', column)] = order[np.searchsorted(values, low, side='left'):np.searchsorted(values, high, side='right')]
+        wanted_codes = {}
+        for column, values in categories.items():
+            wanted_codes[column] = np.array([self.labels[column][value] for value in values if value in self.labels[column]], dtype=np.int64)
+            order, offsets = self.postings[column]
+            slices = [order[offsets[code]:offsets[code + 1]] for code in wanted_codes[column]]
+            candidates[('category', column)] = np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+        if not candidates:
+            return np.arange(self.size)
+
+        # Start from the most selective predicate and check the others on its rows
+        start = min(candidates, key=lambda predicate: len(candidates[predicate]))
+        positions = candidates[start]
+        for kind, column in candidates:
+            if (kind, column) == start or not len(positions):
+                continue
+            if kind == 'range':
+                low, high = ranges[column]
+                values = self.values[column][positions]
+                positions = positions[(values >= low) & (values <= high)]
+            else:
+                positions = positions[np.isin(self.codes[column][positions], wanted_codes[column])]
+        return np.sort(positions)
@@ -0,0 +1,17 @@
+-- Unique keys the refresh upserts changed rows on (SupabaseDatabase.upsert_data).
+-- Duplicate rows left by the delete-all and reinsert refreshes are dropped
+-- first, keeping the latest one.
+
+DELETE FROM property_listing_details a
+    USING property_listing_details b
+    WHERE a.property_number = b.property_number AND a.id < b.id;
+
+ALTER TABLE property_listing_details
+    ADD CONSTRAINT property_listing_details_property_number_key UNIQUE (property_number);
+
+DELETE FROM property_listing_numbers a
+    USING property_listing_numbers b
+    WHERE a.property_number = b.property_number AND a.id < b.id;
+
+ALTER TABLE property_listing_numbers
+    ADD CONSTRAINT property_listing_numbers_property_number_key UNIQUE (property_number);
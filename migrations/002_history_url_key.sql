@@ -0,0 +1,32 @@
+-- Leases are identified by their building's history URL rather than by the
+-- address of one of its listings (schema.HISTORY_KEY).
+
+ALTER TABLE property_listing_history ADD COLUMN IF NOT EXISTS url_history text;
+
+-- Existing leases get the history URL of the listings sharing their address,
+-- when that address belongs to a single building.
+UPDATE property_listing_history h
+    SET url_history = d.url_history
+    FROM (
+        SELECT address, min(url_history) AS url_history
+        FROM property_listing_details
+        WHERE url_history IS NOT NULL
+        GROUP BY address
+        HAVING count(DISTINCT url_history) = 1
+    ) d
+    WHERE h.url_history IS NULL AND h.address = d.address;
+
+-- Leases inserted twice under two addresses of the same building. The local
+-- snapshots only fetch new ids of this table: delete
+-- snapshots/property_listing_history.arrow and run `hk_housing cube --rebuild`
+-- afterwards.
+DELETE FROM property_listing_history a
+    USING property_listing_history b
+    WHERE a.url_history = b.url_history
+      AND a."Flat Name" = b."Flat Name"
+      AND a."Lease Date" = b."Lease Date"
+      AND a."Leased Price (HKD)" = b."Leased Price (HKD)"
+      AND a.id > b.id;
+
+CREATE INDEX IF NOT EXISTS property_listing_history_url_history_idx
+    ON property_listing_history (url_history, "Lease Date");
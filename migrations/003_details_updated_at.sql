@@ -0,0 +1,19 @@
+-- Time of the last write of each listing, the watermark the dashboard
+-- snapshots reconcile on (snapshot_store.RECONCILE_COLUMNS): listings
+-- updated in place keep their id and usually their date_published.
+
+ALTER TABLE property_listing_details
+    ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at = now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Set on every write, whatever the client sends
+DROP TRIGGER IF EXISTS property_listing_details_updated_at ON property_listing_details;
+CREATE TRIGGER property_listing_details_updated_at
+    BEFORE INSERT OR UPDATE ON property_listing_details
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
@@ -0,0 +1,222 @@
+import json
+import numpy as np
+
+try:
+    import lxml.html
+    from lxml import etree
+    FAST_PARSER_AVAILABLE = True
+except ImportError:  # lxml is optional, web_scrapping falls back to BeautifulSoup
+    FAST_PARSER_AVAILABLE = False
+
+# Strings inside these tags are not returned by BeautifulSoup's get_text()
+_NON_CONTENT_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+
+# Labels of the detail table cells looked up on property pages
+_DETAIL_LABELS = {'Address', 'Monthly Rental', 'Saleable Area', 'Floor zone', 'Room and Bathroom', 'Unit Desc'}
+
+
+# Helpers reproducing the BeautifulSoup semantics used by web_scrapping.py
+
+def _classes(element):
+    return element.get('class', '').split()
+
+def _has_class(element, class_name):
+    """Same matching rule as BeautifulSoup's `class_=` argument."""
+    if ' ' in class_name:
+        return ' '.join(_classes(element)) == class_name
+    return class_name in _classes(element)
+
+def _is_element(node):
+    return isinstance(node.tag, str)
+
+def _string(element):
+    """Equivalent of BeautifulSoup's `Tag.string`."""
+    children = list(element)
+    if element.text:
+        return element.text if not children else None
+    if len(children) != 1 or children[0].tail:
+        return None
+    child = children[0]
+    if not _is_element(child):
+        return child.text if child.tag is etree.Comment else None
+    return _string(child)
+
+def _strings(element, in_non_content=False):
+    """Yield the strings BeautifulSoup's `get_text()` would yield, in document order."""
+    in_non_content = in_non_content or element.tag in _NON_CONTENT_TAGS
+    if element.text and not in_non_content:
+        yield element.text
+    for child in element:
+        if _is_element(child):
+            yield from _strings(child, in_non_content)
+        if child.tail and not in_non_content:
+            yield child.tail
+
+def _get_text(element, strip=False, separator=''):
+    """Equivalent of BeautifulSoup's `Tag.get_text()`."""
+    strings = _strings(element, any(a.tag in _NON_CONTENT_TAGS for a in element.iterancestors()))
+    if strip:
+        strings = (s.strip() for s in strings)
+        strings = (s for s in strings if s)
+    return separator.join(strings)
+
+def _find_div(element, class_name):
+    for div in element.iter('div'):
+        if _has_class(div, class_name):
+            return div
+    return None
+
+
+class _DetailPage:
+    """Everything the detail extraction needs, collected in a single walk over the tree."""
+
+    def __init__(self, html_content):
+        self.root = lxml.html.document_fromstring(html_content)
+        self.json_script = None
+        self.title = None
+        self.sub_value = None
+        self.estate_info = None
+        self.tds = []
+        self.labels = {}
+        self.estate_labels = {}
+
+        for element in self.root.iter():
+            tag = element.tag
+            if tag == 'td':
+                label = _string(element)
+                if label in _DETAIL_LABELS:
+                    self.labels.setdefault(label, len(self.tds))
+                    if self.estate_info is not None and self._in_estate_info(element):
+                        self.estate_labels.setdefault(label, len(self.tds))
+                self.tds.append(element)
+            elif tag == 'div':
+                if self.sub_value is None and _has_class(element, 'pairSubValue'):
+                    self.sub_value = element
+                if self.estate_info is None and _has_class(element, 'estateInfo'):
+                    self.estate_info = element
+            elif tag == 'script':
+                if self.json_script is None and element.get('type') == 'application/ld+json':
+                    self.json_script = element
+            elif tag == 'h1':
+                if self.title is None and _has_class(element, 'propertyTitle'):
+                    self.title = element
+
+    def _in_estate_info(self, element):
+        return any(ancestor is self.estate_info for ancestor in element.iterancestors('div'))
+
+    def value_cell(self, label, estate_only=False):
+        """The `td` following the cell labelled `label` (`find(...).find_next('td')`), or None if no such label."""
+        index = (self.estate_labels if estate_only else self.labels).get(label)
+        if index is None:
+            return None
+        return self.tds[index + 1] if index + 1 < len(self.tds) else _MISSING
+
+    def text(self):
+        return _get_text(self.root)
+
+
+class _Missing:
+    """Stands for the None returned by `find_next` so that attribute access fails like BeautifulSoup's."""
+
+
+_MISSING = _Missing()
+
+
+def _pair_value(cell, class_name='pairValue'):
+    if cell is _MISSING:
+        raise AttributeError("'NoneType' object has no attribute 'find'")
+    return _find_div(cell, class_name)
+
+def _pair_value_text(cell, class_name='pairValue', **kwargs):
+    value = _pair_value(cell, class_name)
+    if value is None:
+        raise AttributeError("'NoneType' object has no attribute 'get_text'")
+    return _get_text(value, strip=True, **kwargs)
+
+
+def _url_history(data):
+    """Same as `web_scrapping.extract_url_history`."""
+    try:
+        potential_action = data.get('potentialAction', [])
+        if isinstance(potential_action, list) and potential_action:
+            target = potential_action[0].get('target', {})
+            if isinstance(target, dict):
+                return target.get('urlTemplate', '') + '/transaction/rent'
+        return np.nan
+    except Exception as e:
+        print(f"Error extracting url_history: {e}")
+        return np.nan
+
+
+def parse_property_details_fast(prop_num, html_content, url):
+    """
+    Single-pass lxml version of `web_scrapping.parse_property_details_soup`.
+
+    Produces the same `property_details` dict. Raises on any page layout the
+    soup path would not handle either, so callers can fall back to it and get
+    identical results, errors included.
+    """
+    page = _DetailPage(html_content)
+    property_details = {}
+
+    json_data = page.json_script.text if page.json_script is not None else None
+    if not json_data:
+        raise ValueError(f"No JSON-LD data for property {prop_num}")
+
+    data = json.loads(json_data)
+    main_entity = data.get('mainEntity', {})
+    property_details['date_published'] = data.get('datePublished', 'Not available')
+    property_details['price'] = data.get('offers', {}).get('price', 'Not available')
+    property_details['url_history'] = _url_history(data)
+    if isinstance(main_entity, list):
+        property_details['name'] = _get_text(page.title, strip=True) if page.title is not None else 'Not available'
+        cell = page.value_cell('Address')
+        property_details['address'] = _pair_value_text(cell) if cell is not None else 'Address not available'
+        cell = page.value_cell('Monthly Rental')
+        property_details['price'] = _pair_value_text(cell, 'pairValue price green') if cell is not None else 'Price not available'
+        cell = page.value_cell('Saleable Area')
+        property_details['floor_size'] = _pair_value_text(cell) if cell is not None else 'Not available'
+        property_details['unit_price'] = _get_text(page.sub_value, strip=True) if page.sub_value is not None else 'Not available'
+    else:
+        property_details['type'] = main_entity.get('@type', 'Not available')
+        property_details['latitude'] = main_entity.get('geo', {}).get('latitude', 'Not available')
+        property_details['longitude'] = main_entity.get('geo', {}).get('longitude', 'Not available')
+        property_details['description'] = main_entity.get('description', 'Not available')
+        property_details['floor_size'] = main_entity.get('floorSize', {}).get('value', 'Not available')
+        property_details['floor_size_unit'] = main_entity.get('floorSize', {}).get('unitCode', 'Not available')
+        property_details['address'] = main_entity.get('address', 'Not available')
+        property_details['number_of_rooms'] = main_entity.get('numberOfRooms', 'Not available')
+        property_details['name'] = main_entity.get('name', 'Not available')
+
+    # Estate info
+    num_units = 'Not available'
+    if page.estate_info is not None:
+        cell = page.value_cell('Unit Desc', estate_only=True)
+        if cell is _MISSING:
+            raise AttributeError("'NoneType' object has no attribute 'get_text'")
+        num_units = _get_text(cell, strip=True) if cell is not None else 'Not available'
+    cell = page.value_cell('Floor zone')
+    property_details['num_units'] = num_units
+    property_details['floor_zone'] = _pair_value_text(cell) if cell is not None else 'Not available'
+
+    # Rooms and bathrooms
+    cell = page.value_cell('Room and Bathroom')
+    if cell is not None:
+        value = _pair_value(cell)
+        room_bathroom_text = _get_text(value, strip=True, separator=" ") if value is not None else 'Not available'
+        try:
+            room_info, bathroom_info = room_bathroom_text.split(' ')[0], room_bathroom_text.split(' ')[2] if ' ' in room_bathroom_text else ('Not available', 'Not available')
+        except IndexError:
+            room_info, bathroom_info = 'Not available', 'Not available'
+    else:
+        room_info, bathroom_info = 'Not available', 'Not available'
+    property_details['number_of_rooms'] = room_info
+    property_details['number_of_bathrooms'] = bathroom_info
+
+    # Property type
+    text = page.text()
+    property_details['property_type'] = 'Office' if 'Office Rental' in text else 'Property' if 'Rent Property' in text else 'Not available'
+    property_details['property_number'] = prop_num
+    property_details['url'] = url
+
+    return property_details
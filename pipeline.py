@@ -0,0 +1,102 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from crawl_engine import get_engine
+from progress import get_reporter
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def _spawn_pool(max_workers):
+    # Spawned workers do not inherit the crawl engine's event loop thread
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def get_parse_pool():
+    """Return the process pool shared by all parse stages, started on first use."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = _spawn_pool(os.cpu_count())
+        return _parse_pool
+
+
+def fetch_and_parse(urls, parse_fn, engine=None, parse_workers=None, max_pending=64, progress=None, label="Pages"):
+    """
+    Two-stage scraping pipeline: network fetch, then CPU-bound parsing in worker processes.
+
+    The crawl engine fetches raw pages concurrently and hands them over as they
+    complete; each page is then parsed by `parse_fn(url, html_content)` in a
+    process pool, so parsing is not serialized by the GIL. At most
+    `max_pending` fetched pages wait for a parse worker and at most
+    `max_pending` parse jobs are in flight, which keeps memory bounded: the
+    engine holds back further requests until parsing catches up.
+
+    Parameters:
+        urls (iterable): URLs to fetch.
+        parse_fn (callable): Module-level function `(url, html_content) -> result`.
+        engine (CrawlEngine): Engine used for fetching, defaults to the shared one.
+        parse_workers (int): 0 parses in the calling thread, None uses the shared process pool.
+        max_pending (int): Bound on both the fetched-but-unparsed pages and the parse jobs in flight.
+        progress (ProgressReporter): Reports the number of pages fetched and parsed.
+        label (str): Name of the step given to the progress reporter.
+
+    Returns:
+        list: (url, result) pairs in completion order; result is None when
+        the page could not be fetched or parsed.
+    """
+    engine = engine or get_engine()
+    urls = list(urls)
+    results = []
+    progress = get_reporter(progress)
+    progress.start(label, len(urls))
+
+    if parse_workers == 0:
+        for url, html_content in engine.iter_fetch(urls, max_pending=max_pending):
+            results.append((url, _parse_or_none(parse_fn, url, html_content)))
+            progress.update(len(results))
+        progress.finish()
+        return results
+
+    pool = get_parse_pool() if parse_workers is None else _spawn_pool(parse_workers)
+    future_to_url = {}
+
+    def collect(futures):
+        for future in futures:
+            url = future_to_url.pop(future)
+            try:
+                results.append((url, future.result()))
+            except Exception as e:
+                print(f"Error parsing {url}: {e}")
+                results.append((url, None))
+            progress.update(len(results))
+
+    try:
+        for url, html_content in engine.iter_fetch(urls, max_pending=max_pending):
+            if html_content is None:
+                results.append((url, None))
+                progress.update(len(results))
+                continue
+            future_to_url[pool.submit(parse_fn, url, html_content)] = url
+            if len(future_to_url) >= max_pending:
+                done, _ = wait(future_to_url, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(wait(future_to_url).done)
+    finally:
+        if parse_workers is not None:
+            pool.shutdown()
+
+    progress.finish()
+    return results
+
+
+def _parse_or_none(parse_fn, url, html_content):
+    if html_content is None:
+        return None
+    try:
+        return parse_fn(url, html_content)
+    except Exception as e:
+        print(f"Error parsing {url}: {e}")
+        return None
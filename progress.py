@@ -0,0 +1,70 @@
+import logging
+
+
+class ProgressReporter:
+    """
+    Interface through which the scraper reports progress.
+
+    `start` is called when a step begins with the number of items it will
+    process, `update` after each item with the number done so far, and
+    `finish` at the end. The base class ignores everything.
+    """
+
+    def start(self, label, total):
+        pass
+
+    def update(self, done):
+        pass
+
+    def finish(self):
+        pass
+
+
+class LoggingProgress(ProgressReporter):
+    """Log progress every `step_pct` percent, for headless runs."""
+
+    def __init__(self, step_pct=10, logger=None):
+        self.step_pct = step_pct
+        self.logger = logger or logging.getLogger("hk_housing")
+        self.label = ''
+        self.total = 0
+        self._next_pct = 0
+
+    def start(self, label, total):
+        self.label, self.total, self._next_pct = label, total, self.step_pct
+        self.logger.info(f"{label}: 0/{total}")
+
+    def update(self, done):
+        pct = int(done / self.total * 100) if self.total else 100
+        if pct >= self._next_pct:
+            self.logger.info(f"{self.label}: {done}/{self.total} ({pct}%)")
+            self._next_pct = (pct // self.step_pct + 1) * self.step_pct
+
+    def finish(self):
+        self.logger.info(f"{self.label}: done")
+
+
+class StreamlitProgress(ProgressReporter):
+    """Show progress in a Streamlit progress bar; must be used from the script thread."""
+
+    def __init__(self):
+        self.bar = None
+        self.label = ''
+        self.total = 0
+
+    def start(self, label, total):
+        import streamlit as st
+        self.label, self.total = label, total
+        self.bar = st.progress(0, text=label)
+
+    def update(self, done):
+        pct = int(done / self.total * 100) if self.total else 100
+        self.bar.progress(min(pct, 100), text=f"{self.label} ({done}/{self.total})")
+
+    def finish(self):
+        self.bar.empty()
+
+
+def get_reporter(progress):
+    """Return `progress`, or a reporter ignoring everything when it is None."""
+    return progress if progress is not None else ProgressReporter()
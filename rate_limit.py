@@ -0,0 +1,137 @@
+import asyncio
+import email.utils
+import random
+import time
+
+THROTTLING_STATUSES = {429, 503}
+
+
+def parse_retry_after(value):
+    """Return the delay in seconds requested by a Retry-After header, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RateController:
+    """
+    Shared rate control for every request sent to 28hse.
+
+    Three mechanisms work together:
+    - a token bucket caps the request rate at `rate` per second (bursts up to `burst`),
+    - an AIMD concurrency limit grows by about one slot per round of healthy
+      responses (latency under `latency_target`) and is multiplied by
+      `decrease_factor` on 429/5xx or connection errors,
+    - a Retry-After header pauses all requests until the requested time.
+
+    Must be used from the event loop of the crawl engine.
+
+    Parameters:
+        rate (float): Sustained requests per second.
+        burst (int): Bucket size, i.e. requests allowed back to back.
+        initial_concurrency (int): Concurrency limit at start.
+        min_concurrency (int): Floor of the concurrency limit.
+        max_concurrency (int): Ceiling of the concurrency limit.
+        latency_target (float): Latency in seconds under which the limit may grow.
+        decrease_factor (float): Multiplicative decrease applied on throttling.
+        backoff_base (float): First retry delay in seconds, doubled at each attempt.
+        backoff_max (float): Upper bound of a retry delay in seconds.
+    """
+
+    def __init__(self, rate=10.0, burst=20, initial_concurrency=4, min_concurrency=1, max_concurrency=20,
+                 latency_target=2.0, decrease_factor=0.5, backoff_base=1.0, backoff_max=60.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.concurrency_limit = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._condition = None
+
+        self.counters = {'requests': 0, 'throttled': 0, 'errors': 0}
+        self._latency_total = 0.0
+        self._started_at = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def acquire(self):
+        """Wait for a concurrency slot, the end of any Retry-After pause and a token."""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < int(self.concurrency_limit))
+            self._in_flight += 1
+
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                break
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        return time.monotonic()
+
+    async def release(self, started_at, status=None, retry_after=None):
+        """
+        Record the outcome of a request acquired at `started_at` and free its slot.
+
+        `status` is None when the request failed without a response.
+        """
+        latency = time.monotonic() - started_at
+        self.counters['requests'] += 1
+        self._latency_total += latency
+
+        if status in THROTTLING_STATUSES or status is None or status >= 500:
+            self.counters['throttled' if status in THROTTLING_STATUSES else 'errors'] += 1
+            self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit * self.decrease_factor)
+            if retry_after is not None:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        elif latency <= self.latency_target:
+            # Additive increase: about one more slot once a full window succeeded
+            self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Delay before retry number `attempt` (0-based), honouring Retry-After."""
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # Full jitter spreads retries of concurrent requests apart
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def stats(self):
+        """Return request counters, effective requests/sec, mean latency and current limits."""
+        stats = dict(self.counters)
+        elapsed = time.monotonic() - self._started_at if self._started_at is not None else 0.0
+        stats['requests_per_sec'] = stats['requests'] / elapsed if elapsed > 0 else 0.0
+        stats['mean_latency'] = self._latency_total / stats['requests'] if stats['requests'] else 0.0
+        stats['concurrency_limit'] = int(self.concurrency_limit)
+        stats['rate_limit'] = self.rate
+        return stats
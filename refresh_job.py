@@ -0,0 +1,318 @@
+import contextlib
+import datetime
+import fcntl
+import json
+import os
+import sqlite3
+import pandas as pd
+from config import setting
+from crawl_engine import get_engine
+from database import db
+from schema import DETAILS_SCHEMA, HISTORY_KEY, HISTORY_SCHEMA, LISTING_NUMBERS_SCHEMA, normalize, normalize_details
+from web_scrapping import (
+    get_lease_history_parallel,
+    get_properties_dataframe_parallel,
+    list_of_new_properties_scrapping,
+    list_of_properties_scrapping,
+)
+
+PHASES = ('listings', 'details', 'history')
+
+COLUMNS_DETAILS_DB = ['date_published', 'property_number',
+       'price', 'floor_size', 'floor_size_unit', 'unit_price' ,
+       'latitude', 'longitude', 'address', 'name',
+        'number_of_rooms', 'number_of_bathrooms', 'num_units', 'floor_zone',
+        'property_type', 'description', 'url', 'url_history',
+       ]
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _json_rows(df):
+    return [json.dumps(row, default=str) for row in df.astype(object).where(df.notna(), None).to_dict(orient="records")]
+
+
+def checkpoint_path(job_phases, full_sweep=True, base=None):
+    """
+    Checkpoint file of a job, named after its phases and sweep mode.
+
+    Each refresh command keeps its own checkpoints, so an hourly run neither
+    resumes nor wipes an unfinished nightly one.
+    """
+    root, ext = os.path.splitext(base or setting('refresh', 'checkpoint'))
+    return f"{root}-{'-'.join(job_phases)}{'' if full_sweep else '-incremental'}{ext}"
+
+
+@contextlib.contextmanager
+def refresh_lock(path=None):
+    """
+    Hold the exclusive lock of the refreshes while the block runs.
+
+    Yields False, without waiting, when another refresh holds it: two
+    refreshes would write the same tables.
+    """
+    path = path or setting('refresh', 'checkpoint') + ".lock"
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class CheckpointStore:
+    """
+    Local SQLite store holding the progress of the current refresh job.
+
+    It keeps the listing index snapshot, the detail rows already scraped, the
+    history URLs already done with their rows, and which phases of the job are
+    complete, so an interrupted refresh resumes where it stopped.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or setting('refresh', 'checkpoint')
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS job (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS phases_done (phase TEXT PRIMARY KEY, completed_at TEXT);
+            CREATE TABLE IF NOT EXISTS index_snapshot (position INTEGER PRIMARY KEY, property_number INTEGER);
+            CREATE TABLE IF NOT EXISTS details (property_number INTEGER PRIMARY KEY, data TEXT);
+            CREATE TABLE IF NOT EXISTS history_done (url_history TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS history_rows (data TEXT);
+        """)
+        self.conn.commit()
+
+    def reset(self):
+        """Forget everything about the previous job."""
+        for table in ('job', 'phases_done', 'index_snapshot', 'details', 'history_done', 'history_rows'):
+            self.conn.execute(f"DELETE FROM {table}")
+        self.conn.commit()
+
+    # Job metadata
+
+    def start_job(self, now_ts, job_phases, full_sweep=True):
+        self.conn.executemany("INSERT OR REPLACE INTO job VALUES (?, ?)", [
+            ('now_ts', json.dumps(now_ts)),
+            ('job_phases', json.dumps(list(job_phases))),
+            ('full_sweep', json.dumps(full_sweep)),
+        ])
+        self.conn.commit()
+
+    def job(self):
+        """Return the metadata of the current job as a dict, or None."""
+        rows = dict(self.conn.execute("SELECT key, value FROM job").fetchall())
+        return {key: json.loads(value) for key, value in rows.items()} or None
+
+    def phases_done(self):
+        return {phase for (phase,) in self.conn.execute("SELECT phase FROM phases_done")}
+
+    def mark_phase_done(self, phase):
+        self.conn.execute("INSERT OR REPLACE INTO phases_done VALUES (?, ?)", (phase, datetime.datetime.now().isoformat()))
+        self.conn.commit()
+
+    # Listings phase
+
+    def save_index(self, property_numbers):
+        self.conn.execute("DELETE FROM index_snapshot")
+        self.conn.executemany("INSERT INTO index_snapshot VALUES (?, ?)", enumerate(int(n) for n in property_numbers))
+        self.conn.commit()
+
+    def load_index(self):
+        return [n for (n,) in self.conn.execute("SELECT property_number FROM index_snapshot ORDER BY position")]
+
+    # Details phase
+
+    def save_details(self, df):
+        rows = list(zip(df['property_number'].astype(int).tolist(), _json_rows(df)))
+        self.conn.executemany("INSERT OR REPLACE INTO details VALUES (?, ?)", rows)
+        self.conn.commit()
+
+    def scraped_detail_numbers(self):
+        return {n for (n,) in self.conn.execute("SELECT property_number FROM details")}
+
+    def load_details(self):
+        return normalize(pd.DataFrame([json.loads(data) for (data,) in self.conn.execute("SELECT data FROM details")]), DETAILS_SCHEMA)
+
+    # History phase
+
+    def save_history(self, urls_history, df):
+        """Store the rows scraped for a batch of buildings and mark them done."""
+        rows = [(row,) for row in _json_rows(df)]
+        self.conn.executemany("INSERT INTO history_rows VALUES (?)", rows)
+        self.conn.executemany("INSERT OR IGNORE INTO history_done VALUES (?)", [(url,) for url in urls_history])
+        self.conn.commit()
+
+    def done_history_urls(self):
+        return {url for (url,) in self.conn.execute("SELECT url_history FROM history_done")}
+
+    def load_history(self):
+        return normalize(pd.DataFrame([json.loads(data) for (data,) in self.conn.execute("SELECT data FROM history_rows")]), HISTORY_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+
+class RefreshJob:
+    """
+    Resumable refresh of the Supabase tables, split in three phases.
+
+    - listings: crawl the index pages and save `property_listing_numbers`,
+    - details: scrape the new listings and save `property_listing_details`,
+    - history: scrape the lease history of the listed buildings and append
+      the new transactions to `property_listing_history`.
+
+    Work is checkpointed batch by batch in a CheckpointStore, by default the
+    job's own file (see `checkpoint_path`). Running the job again after a
+    failure skips the completed phases and, inside a phase, the listings and
+    buildings already scraped.
+    """
+
+    def __init__(self, store=None, database=None, details_batch_size=200, history_batch_size=20, progress=None):
+        self.store = store
+        self.db = database or db
+        self.progress = progress
+        self.details_batch_size = details_batch_size
+        self.history_batch_size = history_batch_size
+
+    def run(self, now_ts, phases=PHASES, job_phases=None, full_sweep=True, restart=False):
+        """
+        Run `phases` of the current job, resuming it if it did not complete.
+
+        Only a job started with the same `job_phases` and `full_sweep` is
+        resumed, any other one is dropped: the hourly incremental listings
+        never stand in for the listings of a full refresh. Nothing is run
+        while another refresh holds `refresh_lock`. A completed run prunes
+        the response cache of the pages older than `http_cache_max_age`.
+
+        Parameters:
+            now_ts (float): Timestamp of the refresh, kept when resuming.
+            phases (iterable): Phases to run now.
+            job_phases (iterable): All phases making up the job, defaults to `phases`.
+                The checkpoints are kept until every one of them completed.
+            full_sweep (bool): Crawl every index page rather than only the new listings.
+            restart (bool): Drop the checkpoints of an unfinished job and start over.
+
+        Returns:
+            bool: False if the job was skipped because another refresh was running.
+        """
+        job_phases = list(job_phases or phases)
+        with refresh_lock() as locked:
+            if not locked:
+                print("Another refresh is running, skipping this one")
+                return False
+            if self.store is None:
+                self.store = CheckpointStore(checkpoint_path(job_phases, full_sweep))
+            self._run(now_ts, phases, job_phases, full_sweep, restart)
+            # Otherwise the response cache keeps every page ever fetched
+            get_engine().cache.prune(setting('scraper', 'http_cache_max_age'))
+        return True
+
+    def _run(self, now_ts, phases, job_phases, full_sweep, restart):
+        job = self.store.job()
+        done = self.store.phases_done()
+        same_job = job is not None and job['job_phases'] == job_phases and job.get('full_sweep') == full_sweep
+        if restart or not same_job or set(job_phases) <= done:
+            self.store.reset()
+            self.store.start_job(now_ts, job_phases, full_sweep)
+            done = set()
+        else:
+            now_ts = job['now_ts']
+            print(f"Resuming refresh started at {pd.to_datetime(now_ts, unit='s')}, phases done: {sorted(done)}")
+
+        for phase in phases:
+            if phase in done:
+                print(f"Phase '{phase}' already done, skipping")
+                continue
+            print(f"Running phase '{phase}'")
+            if phase == 'listings':
+                self.run_listings(now_ts, full_sweep)
+            elif phase == 'details':
+                self.run_details()
+            elif phase == 'history':
+                self.run_history()
+            else:
+                raise ValueError(f"Unknown phase '{phase}', expected one of {PHASES}")
+            self.store.mark_phase_done(phase)
+
+    def run_listings(self, now_ts, full_sweep=True):
+        if full_sweep:
+            property_numbers_list = list_of_properties_scrapping(progress=self.progress)
+        else:
+            df_listing_old = self.db.fetch_data("property_listing_details", columns=['property_number'])
+            old_number_list = list(df_listing_old['property_number'].astype(int)) if not df_listing_old.empty else []
+            property_numbers_list = old_number_list + list_of_new_properties_scrapping(old_number_list)
+        self.store.save_index(property_numbers_list)
+
+        df_listing_numbers = pd.DataFrame(property_numbers_list, columns=['property_number'])
+        df_listing_numbers['update_time'] = now_ts
+        df_listing_numbers['update_time']= pd.to_datetime(df_listing_numbers['update_time'], unit='s')
+        df_listing_numbers = normalize(df_listing_numbers, LISTING_NUMBERS_SCHEMA)
+        # update_time records when a listing was first seen: stored rows are left as they are
+        self.db.sync_data(df_listing_numbers, "property_listing_numbers", ["property_number"], compare_columns=[], schema=LISTING_NUMBERS_SCHEMA)
+
+    def run_details(self):
+        property_numbers_list = self.store.load_index()
+        if not property_numbers_list:
+            # A job without the 'listings' phase works from the listing numbers it stored last
+            df_numbers = self.db.fetch_data("property_listing_numbers", columns=['property_number'])
+            if df_numbers.empty:
+                raise RuntimeError("No listing numbers stored, run the 'listings' phase first")
+            property_numbers_list = df_numbers['property_number'].astype(int).tolist()
+            self.store.save_index(property_numbers_list)
+
+        df_listing_old = self.db.fetch_data("property_listing_details")
+        old_numbers = set(df_listing_old['property_number'].astype(int)) if not df_listing_old.empty else set()
+        already_scraped = self.store.scraped_detail_numbers()
+        new_listing = [num for num in property_numbers_list if num not in old_numbers and num not in already_scraped]
+        print(f"{len(new_listing)} listings left to scrape, {len(already_scraped)} already checkpointed")
+
+        for batch in chunks(new_listing, self.details_batch_size):
+            df_batch = get_properties_dataframe_parallel(batch, progress=self.progress)
+            if 'property_number' in df_batch:
+                self.store.save_details(normalize_details(df_batch.dropna(subset=['property_number'])))
+
+        df_listing_new = self.store.load_details().reindex(columns=COLUMNS_DETAILS_DB)
+        # Rows stored as text by older versions are typed on the way
+        df_concat_listing = normalize_details(pd.concat([df_listing_old, df_listing_new]).reset_index(drop=True))
+        df_concat_listing = df_concat_listing.dropna(subset=['date_published']).sort_values('date_published',ascending=False).drop(columns=['id', 'updated_at'], errors='ignore').reset_index(drop=True)
+        self.db.sync_data(df_concat_listing[lambda x : x.property_number.isin(property_numbers_list)], "property_listing_details", ["property_number"], schema=DETAILS_SCHEMA)
+
+    def history_high_water_marks(self):
+        """
+        Latest lease date stored for each building, keyed by url_history.
+
+        A failed read raises: without marks every building would be scraped in full.
+        """
+        df_stored = normalize(self.db.fetch_data("property_listing_history", columns=['url_history', 'Lease Date']), HISTORY_SCHEMA)
+        if df_stored.empty:
+            return {}
+        return df_stored.dropna(subset=['url_history', 'Lease Date']).groupby('url_history')['Lease Date'].max().to_dict()
+
+    def run_history(self):
+        df_listing = self.db.fetch_data("property_listing_details")
+        if df_listing.empty:
+            raise RuntimeError("No listing details stored, run the 'details' phase first")
+        df_listing = normalize(df_listing, DETAILS_SCHEMA).dropna(subset=['url_history'])
+        done_urls = self.store.done_history_urls()
+        urls_history = [url for url in dict.fromkeys(df_listing['url_history']) if url not in done_urls]
+        print(f"{len(urls_history)} buildings left to scrape, {len(done_urls)} already checkpointed")
+        high_water_marks = self.history_high_water_marks()
+
+        for batch in chunks(urls_history, self.history_batch_size):
+            df_batch = get_lease_history_parallel(batch, df_listing, progress=self.progress, high_water_marks=high_water_marks)
+            self.store.save_history(batch, normalize(df_batch, HISTORY_SCHEMA))
+
+        # Only transactions that are not stored yet are inserted
+        df_history_new = self.store.load_history()
+        if df_history_new.empty:
+            return
+        df_history_new = df_history_new.drop_duplicates(HISTORY_KEY)
+        self.db.sync_data(df_history_new, "property_listing_history", HISTORY_KEY, delete_missing=False, compare_columns=[], schema=HISTORY_SCHEMA)
+
@@ -0,0 +1,78 @@
+import hashlib
+import logging
+import sys
+import threading
+from collections import OrderedDict
+
+
+class RenderCache:
+    """
+    LRU cache of rendered page fragments (map HTML, figure JSON) within a byte budget.
+
+    Fragments are keyed by a hash of everything they depend on (see
+    `render_key`): a rerun with the same data version and parameters gets
+    the stored fragment instead of rendering it again. The least recently
+    used fragments are evicted once the budget is exceeded. Shared by the
+    Streamlit sessions, which run in threads.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        """The fragment stored under `key`, or `render()` (a string) stored on a miss."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        value = render()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        size = sys.getsizeof(value)
+        if size > self.max_bytes:
+            logging.info(f"Render cache: fragment of {size} bytes exceeds the budget, not stored.")
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= sys.getsizeof(self.entries.pop(key))
+            self.entries[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= sys.getsizeof(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        """Hit/miss counters and occupancy."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+            }
+
+
+def render_key(*parts):
+    """Hash of what a fragment depends on, e.g. (data version, fragment name, filters, date range)."""
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def cached_render(cache, key, render):
+    """`render()` through `cache`, or directly when there is no cache or no key."""
+    if cache is None or key is None:
+        return render()
+    return cache.get_or_render(key, render)
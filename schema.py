@@ -0,0 +1,117 @@
+import pandas as pd
+
+# Column types of the Supabase tables. Values are normalized to these types
+# once, right after scraping, and stored typed; loading a table back only
+# needs `normalize` to relabel the columns.
+DETAILS_SCHEMA = {
+    'id': 'Int64',
+    'date_published': 'datetime64[ns]',
+    'property_number': 'int64',
+    'price': 'Int64',  # Monthly rent in HKD, scraped as 'HKD$12,345'
+    'floor_size': 'float64',
+    'floor_size_unit': 'category',
+    'unit_price': 'float64',  # HKD per floor size unit
+    'latitude': 'float64',
+    'longitude': 'float64',
+    'address': 'object',
+    'name': 'object',
+    'number_of_rooms': 'category',
+    'number_of_bathrooms': 'category',
+    'num_units': 'object',
+    'floor_zone': 'category',
+    'property_type': 'category',
+    'description': 'object',
+    'url': 'object',
+    'url_history': 'object',
+    'updated_at': 'datetime64[ns]',  # Set by the database on every write
+}
+
+LISTING_NUMBERS_SCHEMA = {
+    'id': 'Int64',
+    'property_number': 'int64',
+    'update_time': 'datetime64[ns]',
+}
+
+HISTORY_SCHEMA = {
+    'id': 'Int64',
+    'Flat Name': 'object',
+    'Size (ft²)': 'float64',
+    'Unit Price (HKD/ft²)': 'float64',
+    'Lease Date': 'datetime64[ns]',
+    'Rooms': 'category',
+    'Leased Price (HKD)': 'Int64',
+    'address': 'object',
+    'latitude': 'float64',
+    'longitude': 'float64',
+    'url_history': 'object',
+}
+
+# Columns identifying a lease transaction in property_listing_history. The
+# building is its history URL: the stored address is that of one of its
+# listings and changes when that listing goes.
+HISTORY_KEY = ['url_history', 'Flat Name', 'Lease Date', 'Leased Price (HKD)']
+
+# Formats of the dates as scraped; ISO 8601 (the stored format) is always accepted
+DATE_FORMATS = {
+    'Lease Date': "%d/%m/%Y",
+}
+
+# Placeholders written by the scraper when a value is missing
+MISSING_VALUES = ['nan', 'None', 'N/A', 'Not available', 'Address not available', 'Price not available']
+
+NUMBER_PATTERN = r"[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?"
+
+
+def normalize(df, schema):
+    """
+    Return `df` with the columns listed in `schema` cast to their type.
+
+    Text as scraped ('HKD$12,345', '12/01/2025', 'Not available') or as
+    stored by older versions (everything as strings) is parsed; placeholders
+    become missing values. Columns that already have their type are left
+    untouched, which makes normalizing typed data nearly free.
+    """
+    df = df.copy()
+    for column, dtype in schema.items():
+        if column not in df or str(df[column].dtype) == dtype:
+            continue
+        values = df[column]
+        is_text = values.dtype == object or pd.api.types.is_string_dtype(values)
+        if is_text:
+            values = values.where(~values.isin(MISSING_VALUES))
+        if dtype == 'datetime64[ns]':
+            df[column] = _to_datetime(values, DATE_FORMATS.get(column))
+        elif dtype in ('int64', 'Int64', 'float64'):
+            if is_text:
+                # astype(float) parses exactly, unlike pd.to_numeric, so stored values round-trip
+                text = values.astype(str).str.replace(r"HKD|[$,@\s]", "", regex=True)
+                values = text.where(text.str.fullmatch(NUMBER_PATTERN)).astype('float64')
+            if dtype != 'float64':
+                # Integer casts refuse fractions such as 'HKD$12,345.5'
+                values = values.astype('float64').round()
+            df[column] = values.astype(dtype)
+        elif dtype == 'category':
+            df[column] = values.astype(str).where(values.notna()).astype('category')
+        else:
+            df[column] = values.astype(str).where(values.notna())
+    return df
+
+
+def normalize_details(df):
+    """Normalize scraped listing details and derive the unit price from the rent."""
+    df = normalize(df, DETAILS_SCHEMA)
+    if 'price' in df and 'floor_size' in df:
+        df['unit_price'] = df['price'].astype('float64') / df['floor_size']
+    return df
+
+
+def _to_datetime(values, date_format=None):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        parsed = values
+    else:
+        parsed = pd.to_datetime(values, format='ISO8601', errors='coerce', utc=True)
+        if date_format:
+            parsed = parsed.fillna(pd.to_datetime(values, format=date_format, errors='coerce', utc=True))
+    if parsed.dt.tz is not None:
+        parsed = parsed.dt.tz_convert(None)
+    return parsed.astype('datetime64[ns]')
@@ -0,0 +1,102 @@
+import logging
+import os
+import time
+import pandas as pd
+import pyarrow as pa
+from config import setting
+from database import db
+from schema import DETAILS_SCHEMA, HISTORY_SCHEMA, normalize
+
+# How each table is kept in sync: 'append' tables only ever get new rows
+# (ids above the local maximum are fetched), 'reconcile' tables can also lose
+# or change rows, so their (id, updated_at) pairs are compared first. The
+# database sets updated_at on every insert and update, see migrations/.
+SNAPSHOT_TABLES = {
+    'property_listing_details': 'reconcile',
+    'property_listing_history': 'append',
+}
+
+SNAPSHOT_SCHEMAS = {
+    'property_listing_details': DETAILS_SCHEMA,
+    'property_listing_history': HISTORY_SCHEMA,
+}
+
+RECONCILE_COLUMNS = ['id', 'updated_at']
+
+
+class SnapshotStore:
+    """
+    Local copy of the Supabase tables as Arrow IPC files.
+
+    `load` reads a table from its file through a memory map and only asks
+    Supabase for the rows that changed since the snapshot was written, so a
+    dashboard start is a local read plus a small delta download. Columns keep
+    the types of their table schema. If Supabase cannot be reached the last
+    snapshot is returned.
+    """
+
+    def __init__(self, directory=None, database=None):
+        self.directory = directory or setting('snapshot', 'directory')
+        self.db = database or db
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, table_name):
+        return os.path.join(self.directory, f"{table_name}.arrow")
+
+    def read(self, table_name):
+        """Return the snapshot of a table, empty if there is none."""
+        path = self.path(table_name)
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+
+    def write(self, table_name, df):
+        """Replace the snapshot of a table; readers see either the old or the new file."""
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        tmp_path = self.path(table_name) + ".tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, self.path(table_name))
+
+    def load(self, table_name):
+        """Bring the snapshot of a table up to date with Supabase and return it."""
+        start = time.perf_counter()
+        local = self.read(table_name)
+        if local.empty:
+            updated = self._cast(table_name, self.db.load_data(table_name))
+        elif SNAPSHOT_TABLES[table_name] == 'append':
+            delta = self._cast(table_name, self.db.load_data(table_name, after=int(local['id'].max())))
+            # Categories differ between the two frames, the concatenation is cast again
+            updated = self._cast(table_name, pd.concat([local, delta], ignore_index=True)) if not delta.empty else local
+        else:
+            updated = self._reconcile(table_name, local)
+
+        if updated is not local and not updated.empty:
+            self.write(table_name, updated)
+        logging.info(f"Snapshot of '{table_name}': {len(updated)} records in {time.perf_counter() - start:.2f}s.")
+        return updated if not updated.empty else local
+
+    def _reconcile(self, table_name, local):
+        """Drop the rows deleted in Supabase and fetch the new or updated ones."""
+        remote = self._cast(table_name, self.db.load_data(table_name, columns=RECONCILE_COLUMNS))
+        if remote.empty:
+            logging.warning(f"Could not list '{table_name}', keeping the local snapshot.")
+            return local
+
+        remote_keys = pd.MultiIndex.from_frame(remote[RECONCILE_COLUMNS].astype(str))
+        local_keys = pd.MultiIndex.from_frame(local[RECONCILE_COLUMNS].astype(str))
+        kept = local[local_keys.isin(remote_keys)]
+        missing_ids = remote['id'][~remote_keys.isin(local_keys)].tolist()
+        if len(kept) == len(local) and not missing_ids:
+            return local
+
+        fetched = self._cast(table_name, self.db.load_ids(table_name, missing_ids)) if missing_ids else pd.DataFrame()
+        if len(fetched) < len(missing_ids):
+            logging.warning(f"Could not fetch the changed rows of '{table_name}', keeping the local snapshot.")
+            return local
+        logging.info(f"Snapshot of '{table_name}': {len(local) - len(kept)} rows dropped, {len(fetched)} fetched.")
+        return self._cast(table_name, pd.concat([kept, fetched], ignore_index=True).sort_values('id', ignore_index=True))
+
+    def _cast(self, table_name, df):
+        return normalize(df, SNAPSHOT_SCHEMAS[table_name]) if not df.empty else df
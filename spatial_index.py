@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+from rtree import index as rtree_index
+from distances import EARTH_RADIUS_KM, haversine_km
+
+# Origin of the local projection, the centre of Hong Kong
+PROJECTION_ORIGIN = (22.3193, 114.1694)
+
+# Entries of data_coordinates_map.json that are regions, not districts
+REGION_KEYS = ('NEW TERRITORIES', 'KOWLOON', 'HONG KONG', 'OVERALL')
+
+# Points tested against a polygon at once, bounds the (points x edges) arrays
+PIP_CHUNK_SIZE = 2000
+
+
+def project_km(latitudes, longitudes, origin=PROJECTION_ORIGIN):
+    """
+    Equirectangular projection to (x, y) km around `origin`.
+
+    Distances are within 0.5% of the true ones across Hong Kong, enough for
+    the bounding-box searches of the index; exact distances are computed on
+    the candidates.
+    """
+    latitudes, longitudes = np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)
+    x = np.radians(longitudes - origin[1]) * EARTH_RADIUS_KM * np.cos(np.radians(origin[0]))
+    y = np.radians(latitudes - origin[0]) * EARTH_RADIUS_KM
+    return x, y
+
+
+class SpatialIndex:
+    """
+    R-tree over the coordinates of a DataFrame, for radius and nearest-neighbour queries.
+
+    Rows sharing a location (all the leases of a building) are stored as one
+    point. Queries return the labels of the matching rows with their distance
+    in km, closest first.
+    """
+
+    def __init__(self, df, lat_column='latitude', lon_column='longitude'):
+        coords = df[[lat_column, lon_column]].to_numpy(dtype=float)
+        valid = ~np.isnan(coords).any(axis=1)
+        self.points, codes = np.unique(coords[valid], axis=0, return_inverse=True)
+        codes = codes.ravel()
+
+        # Rows of point i are at positions[offsets[i]:offsets[i + 1]] in `df`
+        self.labels = df.index
+        self.positions = np.flatnonzero(valid)[np.argsort(codes, kind='stable')]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(self.points)))])
+
+        x, y = project_km(self.points[:, 0], self.points[:, 1])
+        # Bulk loading from a stream, which does not accept an empty one
+        stream = ((i, (x[i], y[i], x[i], y[i]), None) for i in range(len(self.points)))
+        self.index = rtree_index.Index(stream) if len(self.points) else rtree_index.Index()
+
+    def __len__(self):
+        return len(self.points)
+
+    def points_within(self, latitude, longitude, radius_km):
+        """Indices of the points within `radius_km` and their distances in km, closest first."""
+        x, y = project_km(latitude, longitude)
+        margin = radius_km * 1.01  # Covers the projection error
+        candidates = np.fromiter(self.index.intersection((x - margin, y - margin, x + margin, y + margin)), dtype=np.int64)
+        distances = haversine_km(latitude, longitude, self.points[candidates, 0], self.points[candidates, 1])
+        keep = distances <= radius_km
+        order = np.argsort(distances[keep], kind='stable')
+        return candidates[keep][order], distances[keep][order]
+
+    def row_positions(self, points, distances):
+        """Positions, in the indexed DataFrame, of the rows at `points`, with the distance of each row."""
+        counts = self.offsets[points + 1] - self.offsets[points]
+        starts = np.repeat(self.offsets[points], counts)
+        steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.positions[starts + steps], np.repeat(distances, counts)
+
+    def within_radius(self, latitude, longitude, radius_km):
+        """Rows within `radius_km` of (latitude, longitude), as a Series of distances in km."""
+        return self._rows_of(*self.points_within(latitude, longitude, radius_km))
+
+    def nearest(self, latitude, longitude, k):
+        """The `k` rows closest to (latitude, longitude), as a Series of distances in km."""
+        x, y = project_km(latitude, longitude)
+        candidates = np.fromiter(self.index.nearest((x, y, x, y), num_results=k), dtype=np.int64)
+        distances = haversine_km(latitude, longitude, self.points[candidates, 0], self.points[candidates, 1])
+        order = np.argsort(distances, kind='stable')
+        return self._rows_of(candidates[order], distances[order]).iloc[:k]
+
+    def _rows_of(self, points, distances):
+        positions, distances = self.row_positions(points, distances)
+        return pd.Series(distances, index=self.labels[positions], name='distance_km')
+
+
+class DistrictIndex:
+    """
+    District lookup by point-in-polygon against data_coordinates_map.json.
+
+    Polygons are given as [lon, lat] rings; the region entries (REGION_KEYS)
+    are skipped. An R-tree over the polygon bounding boxes limits the exact
+    test to the districts that can contain a point.
+    """
+
+    def __init__(self, coordinates_map):
+        self.names = []
+        self.polygons = []  # (lat, lon) vertices
+        for name, ring in coordinates_map.items():
+            if name in REGION_KEYS:
+                continue
+            self.names.append(name)
+            self.polygons.append(np.asarray(ring, dtype=float)[:, ::-1])
+        self.bboxes = np.array([[p[:, 0].min(), p[:, 1].min(), p[:, 0].max(), p[:, 1].max()] for p in self.polygons]).reshape(-1, 4)
+        self.index = rtree_index.Index(((i, tuple(bbox), None) for i, bbox in enumerate(self.bboxes)))
+
+    def district_at(self, latitude, longitude):
+        """Name of the district containing (latitude, longitude), or None."""
+        for i in sorted(self.index.intersection((latitude, longitude, latitude, longitude))):
+            if _points_in_polygon(np.array([latitude]), np.array([longitude]), self.polygons[i])[0]:
+                return self.names[i]
+        return None
+
+    def assign(self, latitudes, longitudes):
+        """
+        District of each point, None outside every district.
+
+        Each distinct location is tested once, against the polygons whose
+        bounding box contains it.
+        """
+        coords = np.column_stack([np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)])
+        result = np.full(len(coords), None, dtype=object)
+        valid = ~np.isnan(coords).any(axis=1)
+        if not valid.any():
+            return result
+        uniques, inverse = np.unique(coords[valid], axis=0, return_inverse=True)
+        districts = np.full(len(uniques), None, dtype=object)
+        for i, (polygon, bbox) in enumerate(zip(self.polygons, self.bboxes)):
+            candidates = np.flatnonzero(
+                (districts == None) &  # noqa: E711, elementwise comparison
+                (uniques[:, 0] >= bbox[0]) & (uniques[:, 1] >= bbox[1]) &
+                (uniques[:, 0] <= bbox[2]) & (uniques[:, 1] <= bbox[3]))
+            if len(candidates):
+                inside = _points_in_polygon(uniques[candidates, 0], uniques[candidates, 1], polygon)
+                districts[candidates[inside]] = self.names[i]
+        result[valid] = districts[inverse.ravel()]
+        return result
+
+
+def _points_in_polygon(latitudes, longitudes, polygon):
+    """Even-odd ray casting of many points against one (lat, lon) polygon."""
+    y1, x1 = polygon[:, 0], polygon[:, 1]
+    y2, x2 = np.roll(y1, -1), np.roll(x1, -1)
+    inside = np.zeros(len(latitudes), dtype=bool)
+    for start in range(0, len(latitudes), PIP_CHUNK_SIZE):
+        py = latitudes[start:start + PIP_CHUNK_SIZE, None]
+        px = longitudes[start:start + PIP_CHUNK_SIZE, None]
+        crosses = (y1 > py) != (y2 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_at = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        inside[start:start + PIP_CHUNK_SIZE] = (crosses & (px < x_at)).sum(axis=1) % 2 == 1
+    return inside
@@ -1,11 +1,15 @@
 import plotly.graph_objects as go
-import html
+import plotly.io as pio
+import streamlit as st
 from streamlit.components.v1 import html as st_html
+import numpy as np
 import pandas as pd
 import folium
 from branca.colormap import linear
 from plotly.subplots import make_subplots
-from folium.plugins import MarkerCluster
+from folium.plugins import FastMarkerCluster, MarkerCluster
+from geometry import district_geojson
+from render_cache import cached_render
 
 # Styling Functions
 def style_values(value, negative_style="color:red;", positive_style="color:green;"):
@@ -28,7 +32,96 @@ def style_dataframe(df):
             .applymap(style_values, subset=['unit_price_vs_histo']))  # Apply additional styling to specific columns
 
 
-def plot_map(df):
+# Markers drawn by plot_map in fast mode, beyond that the first listings are shown
+MAX_MAP_POINTS = 10_000
+
+# Zoom of the district maps, which selects the simplification of the polygons
+DISTRICT_MAP_ZOOM = 10
+
+# Offset (degrees) between listings sharing the same coordinates
+JITTER_STEP = 0.0001
+
+# Fields of each marker, escaped for HTML; the popup is assembled from them
+MARKER_FIELDS = ['latitude', 'longitude', 'province', 'area', 'price', 'floor_size', 'url', 'url_transit', 'url_history']
+
+# Builds each marker in the browser from a MARKER_FIELDS row of FastMarkerCluster, like `popup_html`
+MARKER_CALLBACK = """
+function (row) {
+    var popup = row[2] + "<br>" + row[3] + "<br>HKD$" + row[4] + "<br>" + row[5] + " sf<br>"
+        + '<a href="' + row[6] + '" target="_blank">Listing</a><br>'
+        + '<a href="' + row[7] + '" target="_blank">Transit</a><br>'
+        + (row[8] ? '<a href="' + row[8] + '" target="_blank">History</a>' : "");
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(popup, {maxWidth: 300});
+    return marker;
+};
+"""
+
+
+def escape_html(values):
+    """Vectorized `html.escape` of a Series, missing values become empty strings."""
+    values = values.fillna('').astype(str)
+    for char, entity in (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'), ('"', '&quot;'), ("'", '&#x27;')):
+        values = values.str.replace(char, entity, regex=False)
+    return values
+
+
+def map_markers(df):
+    """
+    MARKER_FIELDS of each listing: coordinates and HTML-escaped strings.
+
+    Listings sharing the same coordinates are shifted by JITTER_STEP per
+    repeat so they do not overlap; rows without coordinates are dropped.
+    """
+    df = df.dropna(subset=['latitude', 'longitude'])
+    repeat = df.groupby(['latitude', 'longitude']).cumcount() * JITTER_STEP
+    markers = pd.DataFrame({
+        'latitude': (df['latitude'].astype(float) + repeat).round(6),
+        'longitude': (df['longitude'].astype(float) + repeat).round(6),
+        'price': df['price'].map('{:,}'.format, na_action='ignore').fillna(''),
+    })
+    for column in ['province', 'area', 'floor_size', 'url', 'url_transit', 'url_history']:
+        markers[column] = escape_html(df[column])
+    return markers[MARKER_FIELDS]
+
+
+def popup_html(markers):
+    """Popup of each marker of `map_markers`, the same as MARKER_CALLBACK builds."""
+    history = ('<a href="' + markers['url_history'] + '" target="_blank">History</a>').where(markers['url_history'] != '', '')
+    return (markers['province'] + "<br>" + markers['area'] + "<br>HKD$" + markers['price'] + "<br>"
+            + markers['floor_size'] + " sf<br>"
+            + '<a href="' + markers['url'] + '" target="_blank">Listing</a><br>'
+            + '<a href="' + markers['url_transit'] + '" target="_blank">Transit</a><br>'
+            + history)
+
+
+def plot_map(df, fast=True, cache=None, cache_key=None):
+    """
+    Map of the listings, clustered, with a popup per listing.
+
+    In fast mode the markers are sent as one array and built by
+    FastMarkerCluster in the browser, capped at MAX_MAP_POINTS; otherwise
+    each listing is a folium.Marker, which only suits a few hundred rows.
+    Given a RenderCache and a `cache_key` (see render_key) identifying `df`,
+    the HTML of an earlier identical map is reused.
+    """
+    # Ensure necessary columns exist
+    required_cols = ['province', 'area', 'price', 'floor_size', 'latitude', 'longitude', 'url', 'url_transit', 'url_history']
+    if not all(col in df.columns for col in required_cols):
+        print("DataFrame is missing one or more required columns.")
+        return
+
+    located = int(df[['latitude', 'longitude']].notna().all(axis=1).sum())
+    if fast and located > MAX_MAP_POINTS:
+        st.caption(f"Map showing the first {MAX_MAP_POINTS:,} of {located:,} listings.")
+    map_html = cached_render(cache, cache_key, lambda: listing_map_html(df, fast))
+    
+    # Display the map in Streamlit with custom size
+    st_html(map_html, height=800, width=1000)
+
+
+def listing_map_html(df, fast=True):
+    """HTML page of the listing map drawn by `plot_map`."""
     # Define the center of the map (latitude, longitude)
     center_latitude = 22.3193  # Latitude for Hong Kong
     center_longitude = 114.1694  # Longitude for Hong Kong
@@ -36,180 +129,153 @@ def plot_map(df):
     # Create the map centered at the specified coordinates
     property_map = folium.Map(location=[center_latitude, center_longitude], zoom_start=13)
 
-    # Ensure necessary columns exist
-    required_cols = ['province', 'area', 'price', 'floor_size', 'latitude', 'longitude', 'url', 'url_transit', 'url_history']
-    if not all(col in df.columns for col in required_cols):
-        print("DataFrame is missing one or more required columns.")
-        return
+    markers = map_markers(df)
+    if fast:
+        FastMarkerCluster(markers.iloc[:MAX_MAP_POINTS].values.tolist(), callback=MARKER_CALLBACK).add_to(property_map)
+    else:
+        # Use MarkerCluster to group markers at similar locations
+        marker_cluster = MarkerCluster().add_to(property_map)
+        for latitude, longitude, popup_content in zip(markers['latitude'], markers['longitude'], popup_html(markers)):
+            folium.Marker([latitude, longitude], popup=folium.Popup(popup_content, max_width=300)).add_to(marker_cluster)
+
+    # The page itself, _repr_html_ would wrap it in an escaped iframe inside Streamlit's own
+    return property_map.get_root().render()
 
-    # Use MarkerCluster to group markers at similar locations
-    marker_cluster = MarkerCluster().add_to(property_map)
-
-    # Dictionary to track identical coordinates
-    coordinate_count = {}
-
-    # Loop through each property in the DataFrame and add a marker
-    for index, row in df.iterrows():
-        try:
-            latitude = float(row['latitude'])
-            longitude = float(row['longitude'])
-
-            # Check for duplicate coordinates and apply small offsets if needed
-            coord_key = (latitude, longitude)
-            if coord_key in coordinate_count:
-                coordinate_count[coord_key] += 1
-                latitude += 0.0001 * coordinate_count[coord_key]  # Slight offset to prevent overlap
-                longitude += 0.0001 * coordinate_count[coord_key]
-            else:
-                coordinate_count[coord_key] = 0
-
-            # Construct the popup content
-            popup_content = f"""
-            {html.escape(row['province'])}<br>
-            {html.escape(row['area'])}<br>
-            {html.escape(str(row['price']))}<br>
-            {html.escape(str(row['floor_size']))} sf<br>
-            <a href="{html.escape(row['url'])}" target="_blank">Listing</a><br>
-            <a href="{html.escape(row['url_transit'])}" target="_blank">Transit</a><br>
-            """
-            # Add url_history only if it's not NaN
-            if not (pd.isna(row['url_history']) or row['url_history'] == ''):
-                popup_content += f'<a href="{html.escape(row["url_history"])}" target="_blank">History</a>'
-
-            # Add marker to the cluster
-            folium.Marker(
-                [latitude, longitude],
-                popup=folium.Popup(popup_content, max_width=300)
-            ).add_to(marker_cluster)
-
-        except Exception as e:
-            print(f"Error adding marker for property {row['property_number']}: {e}")
-            
-    # Save the map as an HTML string
-    map_html = property_map._repr_html_()
+
+def plot_map_color(district_prices, district_geometry, cache=None, cache_key=None):
+    """
+    Districts colored by `district_prices`, a Series of unit prices indexed by district (see `cube_range`).
+
+    Given a RenderCache and a `cache_key` identifying the prices, the HTML
+    of an earlier identical map is reused.
+    """
+    map_html = cached_render(cache, cache_key, lambda: district_map_html(district_prices, district_geometry))
     
     # Display the map in Streamlit with custom size
     st_html(map_html, height=800, width=1000)
 
 
-def plot_map_color(df, coordinates_map):
+def district_map_html(district_prices, district_geometry):
+    """
+    HTML page of the district map drawn by `plot_map_color`.
+
+    The districts are drawn as a single GeoJSON layer from the rings of
+    `district_geometry` simplified for the map's zoom (see geometry.load_geometry).
+    """
     # Center of the map
     center_latitude = 22.3193  # Latitude for Hong Kong
     center_longitude = 114.1694  # Longitude for Hong Kong
 
-    df_price_district = df[['area_district','unit_price']].dropna().groupby(['area_district']).mean()
+    df_price_district = district_prices.dropna().to_frame('unit_price')
     
     # Create the map centered at the specified coordinates, with a less zoomed-in view
-    m = folium.Map(location=[center_latitude, center_longitude], zoom_start=10)
+    m = folium.Map(location=[center_latitude, center_longitude], zoom_start=DISTRICT_MAP_ZOOM)
+    if df_price_district.empty:
+        return m.get_root().render()
     
     # Define color scale (using a linear color map based on unit_price)
     colormap = linear.YlOrRd_09.scale(df_price_district['unit_price'].min(), df_price_district['unit_price'].max())
     
-    for key, geo_coords in coordinates_map.items():
-        # Get the value associated with the current district
-        if key in df_price_district.index:
-            value = df_price_district.loc[key, 'unit_price']
-        else:
-            value = None  # Handle districts without data
-        
-        # Skip districts with no value
-        if value is None:
-            continue
-        
-        # Get the color based on the value (price)
-        color = colormap(value)
-        
-        # Add the polygon to the map with the color
-        folium.Polygon(
-            locations=[coord[::-1] for coord in geo_coords],  # Reverse (lon, lat) to (lat, lon)
-            fill=True,
-            fill_color=color,
-            color=color,
-            weight=2,
-            fill_opacity=0.5,
-            popup=f"{key}: {value:.2f}"  # Add popup showing district and price
-        ).add_to(m)
+    # Color and popup of each district with a value, as feature properties
+    properties = {
+        key: {'color': colormap(value), 'popup': f"{key}: {value:.2f}"}
+        for key, value in df_price_district['unit_price'].items()
+    }
+    folium.GeoJson(
+        district_geojson(district_geometry[DISTRICT_MAP_ZOOM], properties),
+        style_function=lambda feature: {
+            'fillColor': feature['properties']['color'],
+            'color': feature['properties']['color'],
+            'weight': 2,
+            'fillOpacity': 0.5,
+        },
+        popup=folium.GeoJsonPopup(fields=['popup'], labels=False),
+    ).add_to(m)
     
     # Add the colormap to the map
     colormap.caption = "Unit Price by District"
     colormap.add_to(m)
     
-    # Save the map as an HTML string
-    map_html = m._repr_html_()
-    
-    # Display the map in Streamlit with custom size
-    st_html(map_html, height=800, width=1000)
-
-
-def plot_unit_price_evolution(df_print,column):
-    # Convert DataFrame to long format
-    df_melted = df_print.reset_index().melt(id_vars=[column], var_name="Year", value_name="Unit Price")
-
-    # Convert 'Year' to integer for proper sorting
-    df_melted["Year"] = df_melted["Year"].astype(int)
-
-    # Sort the DataFrame properly
-    df_melted = df_melted.sort_values(by=[column, "Year"])
-
-    # Compute the percentage change
-    df_melted["Previous Price"] = df_melted.groupby(column)["Unit Price"].shift(1)
-    df_melted["Change (%)"] = ((df_melted["Unit Price"] - df_melted["Previous Price"]) / df_melted["Previous Price"]) * 100
-
-    # Handle NaN values (first year should not have a % change)
-    df_melted["Change (%)"] = df_melted["Change (%)"].fillna(0)  # First year is set to 0 for now
-
-    # Define a color scale for -10% (red) to +10% (green), centered at 0 (white)
-    def get_color(change):
-        if change == 0:
-            return "black"  # First year is always black
-        elif change < -10:
-            return "darkred"
-        elif change > 10:
-            return "darkgreen"
-        else:
-            # Interpolate color between red (-10%) to white (0%) to green (+10%)
-            red = max(0, min(255, int(255 * (1 - (change + 10) / 20))))
-            green = max(0, min(255, int(255 * ((change + 10) / 20))))
-            return f"rgb({red},{green},0)"  # Dynamic color
-
-    df_melted["Color"] = df_melted["Change (%)"].apply(get_color)
-
-    # Get the list of districts
-    districts = df_melted[column].unique()
+    # The page itself, _repr_html_ would wrap it in an escaped iframe inside Streamlit's own
+    return m.get_root().render()
+
+
+def price_changes(df_print, column):
+    """
+    Long format of a geography x year price table with the change from the previous year.
+
+    Returns:
+        DataFrame: `column`, 'Year', 'Unit Price', 'Previous Price', 'Change (%)'
+        (0 for the first year), 'Color' and 'Label' (the change as text), sorted
+        by `column` and year.
+    """
+    table = df_print.sort_index()
+    years = table.columns.astype(int).to_numpy()
+    order = np.argsort(years, kind='stable')
+    years = years[order]
+    prices = table.to_numpy(dtype=float)[:, order]
+    previous = np.full_like(prices, np.nan)
+    previous[:, 1:] = prices[:, :-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = ((prices - previous) / previous) * 100
+    change = np.where(np.isnan(change), 0, change)  # First year is set to 0 for now
+
+    df = pd.DataFrame({
+        column: np.repeat(table.index.to_numpy(), len(years)),
+        'Year': np.tile(years, len(table)),
+        'Unit Price': prices.ravel(),
+        'Previous Price': previous.ravel(),
+        'Change (%)': change.ravel(),
+    })
+    df['Color'] = change_colors(df['Change (%)'].to_numpy())
+    df['Label'] = np.where(df['Previous Price'] != 0, np.char.mod('%.1f%%', df['Change (%)'].to_numpy()), 'N/A')
+    return df
+
+
+def change_colors(change):
+    """
+    Bar color of each change (%): black for 0 (first year), red (-10%) to green
+    (+10%) in between, darkred/darkgreen beyond.
+    """
+    scaled = np.clip(change, -10, 10)
+    red = np.clip(np.trunc(255 * (1 - (scaled + 10) / 20)), 0, 255).astype(int).astype(str)
+    green = np.clip(np.trunc(255 * ((scaled + 10) / 20)), 0, 255).astype(int).astype(str)
+    gradient = np.char.add(np.char.add(np.char.add(np.char.add('rgb(', red), ','), green), ',0)')
+    return np.select([change == 0, change < -10, change > 10], ['black', 'darkred', 'darkgreen'], gradient)
+
+
+def plot_unit_price_evolution(df_print, column, df_changes=None):
+    """Yearly unit price bars of each geography, one subplot per geography, colored by the change from the previous year."""
+    df_changes = price_changes(df_print, column) if df_changes is None else df_changes
+    groups = df_changes.groupby(column, sort=False)
+    districts = list(groups.groups)
 
     # Define subplot grid size (auto-adjust based on number of districts)
     rows = (len(districts) // 4) + 1  # 4 columns per row
-    cols = min(len(districts), 4)  # Maximum 3 per row
+    cols = min(len(districts), 4)  # Maximum 4 per row
 
-    # Create subplots with increased vertical spacing
     fig = make_subplots(
-        rows=rows, 
-        cols=cols, 
-        subplot_titles=districts, 
+        rows=rows,
+        cols=cols,
+        subplot_titles=districts,
         vertical_spacing=0.05,  # Increase the vertical space between rows
         shared_xaxes=False,
         shared_yaxes=True,
     )
-
-    # Iterate through districts and add bar charts
-    for i, district in enumerate(districts):
-        row = (i // 4) + 1
-        col = (i % 4) + 1
-        
-        district_data = df_melted[df_melted[column] == district]
-
-        # Add bar trace
-        fig.add_trace(
-            go.Bar(
-                x=district_data["Year"], 
-                y=district_data["Unit Price"], 
-                marker=dict(color=district_data["Color"]),  # Color based on % change
-                name=district,
-                text=[f"{val:.1f}%" if prev != 0 else "N/A" for val, prev in zip(district_data["Change (%)"], district_data["Previous Price"])], 
-                textposition="auto"  # Show % change above bars
-            ),
-            row=row, col=col
+    # Plain dicts, validated once by add_traces
+    traces = [
+        dict(
+            type="bar",
+            x=district_data["Year"].to_numpy(),
+            y=district_data["Unit Price"].to_numpy(),
+            marker=dict(color=district_data["Color"].to_numpy()),  # Color based on % change
+            name=district,
+            text=district_data["Label"].to_numpy(),
+            textposition="auto",  # Show % change above bars
         )
+        for district, district_data in groups
+    ]
+    fig.add_traces(traces, rows=[i // 4 + 1 for i in range(len(traces))], cols=[i % 4 + 1 for i in range(len(traces))])
 
     # Update layout for readability
     fig.update_layout(
@@ -221,3 +287,42 @@ def plot_unit_price_evolution(df_print,column):
     )
 
     return fig
+
+
+def plot_unit_price_heatmap(df_print, column, df_changes=None):
+    """
+    Geography x year heatmap of the change from the previous year, the data of
+    `plot_unit_price_evolution` in a single trace; the unit price is in the hover.
+    """
+    df_changes = price_changes(df_print, column) if df_changes is None else df_changes
+    districts = df_changes[column].unique()
+    years = df_changes['Year'].unique()
+    shape = (len(districts), len(years))  # price_changes has every geography x year, sorted
+
+    fig = go.Figure(go.Heatmap(
+        x=years,
+        y=districts,
+        z=df_changes['Change (%)'].to_numpy().reshape(shape),
+        customdata=df_changes['Unit Price'].to_numpy().reshape(shape),
+        text=df_changes['Label'].to_numpy().reshape(shape),
+        texttemplate="%{text}",
+        hovertemplate="%{y} %{x}<br>Unit Price: %{customdata:.1f}<br>Change: %{text}<extra></extra>",
+        colorscale=[[0, "rgb(255,0,0)"], [0.5, "rgb(127,127,0)"], [1, "rgb(0,255,0)"]],
+        zmin=-10,
+        zmax=10,
+        colorbar=dict(title="Change (%)"),
+    ))
+    fig.update_layout(
+        title_text="Unit Price Change by District (%)",
+        height=max(300, 25 * len(districts) + 150),
+        width=1200,
+        margin=dict(t=80, b=80, l=50, r=50),
+        yaxis=dict(autorange="reversed", type="category"),
+        xaxis=dict(type="category"),
+    )
+    return fig
+
+
+def cached_figure(cache, cache_key, build):
+    """Figure returned by `build()`, stored as JSON in the RenderCache so identical reruns skip building it."""
+    return pio.from_json(cached_render(cache, cache_key, lambda: build().to_json()))
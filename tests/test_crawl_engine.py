@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import pytest
+from aiohttp import web
+from crawl_engine import CrawlEngine
+from rate_limit import RateController
+
+
+class StandInServer:
+    """
+    Local aiohttp server standing in for 28hse, run on its own event loop thread.
+
+    It records the peak number of requests in flight, the hits per path and
+    the client port of every request, which tells the connections apart.
+    `failures` maps a path to the statuses answered before it succeeds.
+    """
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.in_flight = 0
+        self.peak = 0
+        self.hits = {}
+        self.client_ports = []
+        self.failures = {}
+        self._loop = asyncio.new_event_loop()
+        self._runner = None
+        self.port = None
+
+    async def handle(self, request):
+        self.hits[request.path] = self.hits.get(request.path, 0) + 1
+        self.client_ports.append(request.transport.get_extra_info('peername')[1])
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        statuses = self.failures.get(request.path)
+        if statuses:
+            return web.Response(status=statuses.pop(0))
+        return web.Response(text=f"page {request.path}")
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_get('/{path:.*}', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def start(self):
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.port}/{path}"
+
+
+def make_engine(max_concurrency=20, max_per_host=10, max_retries=2):
+    """Engine whose rate controller lets every request through at once, so only the engine caps apply."""
+    rate_controller = RateController(rate=1000.0, burst=1000, initial_concurrency=50, max_concurrency=50, backoff_base=0.01)
+    return CrawlEngine(max_concurrency=max_concurrency, max_per_host=max_per_host, max_retries=max_retries,
+                       rate_controller=rate_controller)
+
+
+@pytest.fixture
+def server():
+    server = StandInServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def other_server():
+    server = StandInServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def engines():
+    created = []
+
+    def create(**kwargs):
+        created.append(make_engine(**kwargs))
+        return created[-1]
+
+    yield create
+    for engine in created:
+        engine.close()
+
+
+def test_global_concurrency_cap(server, engines):
+    engine = engines(max_concurrency=3)
+    pages = engine.fetch_all(server.url(f"page-{i}") for i in range(20))
+    assert pages == [f"page /page-{i}" for i in range(20)]
+    assert server.peak == 3
+
+
+def test_per_host_concurrency_cap(server, other_server, engines):
+    engine = engines(max_concurrency=20, max_per_host=2)
+    urls = [server.url(f"page-{i}") for i in range(10)] + [other_server.url(f"page-{i}") for i in range(10)]
+    results = {}
+    for url, text in engine.iter_fetch(urls):
+        results[url] = text
+    assert all(results[url] is not None for url in urls)
+    # Each host gets at most two connections, but the hosts are served side by side
+    assert server.peak == 2
+    assert other_server.peak == 2
+
+
+def test_connections_are_reused(server, engines):
+    engine = engines(max_per_host=2)
+    for i in range(5):
+        assert engine.fetch_one(server.url(f"page-{i}")) == f"page /page-{i}"
+    assert len(set(server.client_ports)) == 1
+
+    engine.fetch_all(server.url(f"page-{i}") for i in range(20))
+    assert len(set(server.client_ports)) <= 2
+
+
+def test_server_errors_are_retried(server, engines):
+    engine = engines(max_retries=2)
+    server.failures['/flaky'] = [503, 500]
+    assert engine.fetch_one(server.url("flaky")) == "page /flaky"
+    assert server.hits['/flaky'] == 3
+
+
+def test_gives_up_after_max_retries(server, engines):
+    engine = engines(max_retries=2)
+    server.failures['/down'] = [500] * 5
+    assert engine.fetch_one(server.url("down")) is None
+    assert server.hits['/down'] == 3
+
+
+def test_client_errors_are_not_retried(server, engines):
+    engine = engines(max_retries=2)
+    server.failures['/missing'] = [404]
+    assert engine.fetch_one(server.url("missing")) is None
+    assert server.hits['/missing'] == 1
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from geopy.distance import geodesic
+from data import citymapper_url_from_coords
+from distances import citymapper_urls, geodesic_km
+
+# Agreement with geopy stated by geodesic_km, 1 mm
+TOLERANCE_KM = 1e-6
+
+OFFICE = (22.28492, 114.15951)
+
+
+def random_pairs(seed, n, lat_range, lon_range):
+    rng = np.random.default_rng(seed)
+    return (rng.uniform(*lat_range, n), rng.uniform(*lon_range, n),
+            rng.uniform(*lat_range, n), rng.uniform(*lon_range, n))
+
+
+def geopy_km(lat1, lon1, lat2, lon2):
+    return np.array([geodesic((a, b), (c, d)).km for a, b, c, d in zip(lat1, lon1, lat2, lon2)])
+
+
+@pytest.mark.parametrize('lat_range, lon_range', [
+    ((22.15, 22.57), (113.83, 114.44)),  # Hong Kong
+    ((-89.0, 89.0), (-180.0, 180.0)),
+], ids=['hong-kong', 'global'])
+def test_geodesic_matches_geopy(lat_range, lon_range):
+    lat1, lon1, lat2, lon2 = random_pairs(14, 2000, lat_range, lon_range)
+    # The nearly antipodal pairs fall back to the haversine, see geodesic_km
+    antipodal = np.abs(np.abs(lon2 - lon1) - 180) < 1
+    expected = geopy_km(lat1, lon1, lat2, lon2)
+    error = np.abs(geodesic_km(lat1, lon1, lat2, lon2) - expected)
+    assert error[~antipodal].max() < TOLERANCE_KM
+
+
+def test_geodesic_from_one_origin_broadcasts():
+    _, _, lat2, lon2 = random_pairs(15, 200, (22.15, 22.57), (113.83, 114.44))
+    expected = geopy_km(np.full(200, OFFICE[0]), np.full(200, OFFICE[1]), lat2, lon2)
+    assert np.abs(geodesic_km(OFFICE[0], OFFICE[1], lat2, lon2) - expected).max() < TOLERANCE_KM
+
+
+def test_citymapper_urls_match_the_per_row_url():
+    _, _, latitudes, longitudes = random_pairs(16, 1000, (22.15, 22.57), (113.83, 114.44))
+    # Values whose shortest repr is short or uses an exponent
+    latitudes[:3] = [22.3, 22.0, 1e-05]
+    expected = [citymapper_url_from_coords(OFFICE, (lat, lon)) for lat, lon in zip(latitudes.tolist(), longitudes.tolist())]
+    assert citymapper_urls(OFFICE, latitudes, longitudes) == expected
@@ -0,0 +1,60 @@
+import glob
+import math
+import os
+import pytest
+from parsers import parse_property_details_fast
+from web_scrapping import parse_property_details, parse_property_details_soup, property_url
+
+# Detail pages following the 28hse layouts, one per branch of the parsers:
+# JSON-LD entity or table fallback, estate info present or not, room
+# formats, office and residential listings, missing fields
+PAGES_DIR = os.path.join(os.path.dirname(__file__), 'pages', 'details')
+PAGES = sorted(glob.glob(os.path.join(PAGES_DIR, 'property-*.html')))
+
+# Pages the fast parser refuses, left to the BeautifulSoup fallback
+SOUP_ONLY_PAGES = {'property-3180006.html'}
+
+
+def read_page(path):
+    """(property number, html) of a saved page named property-<number>.html."""
+    number = int(os.path.basename(path)[len('property-'):-len('.html')])
+    with open(path, encoding='utf-8') as f:
+        return number, f.read()
+
+
+def assert_same_details(actual, expected):
+    """Equality of two property_details dicts, NaN matching NaN."""
+    assert actual.keys() == expected.keys()
+    for key, value in expected.items():
+        if isinstance(value, float) and math.isnan(value):
+            assert isinstance(actual[key], float) and math.isnan(actual[key]), key
+        else:
+            assert actual[key] == value, key
+
+
+def test_corpus_is_present():
+    assert len(PAGES) >= 9
+
+
+@pytest.mark.parametrize('path', PAGES, ids=os.path.basename)
+def test_fast_parser_matches_soup(path):
+    number, html = read_page(path)
+    expected = parse_property_details_soup(number, html)
+    if os.path.basename(path) in SOUP_ONLY_PAGES:
+        with pytest.raises(Exception):
+            parse_property_details_fast(number, html, property_url(number))
+    else:
+        assert_same_details(parse_property_details_fast(number, html, property_url(number)), expected)
+    # What the scraper calls: the fast parser with the soup fallback
+    assert_same_details(parse_property_details(number, html), expected)
+
+
+def test_fields_of_a_listing_page():
+    number, html = read_page(os.path.join(PAGES_DIR, 'property-3180001.html'))
+    details = parse_property_details_fast(number, html, property_url(number))
+    assert details['price'] == 'HKD$23,800'
+    assert details['url_history'] == 'https://www.28hse.com/en/estate/detail/tai-koo-shing/transaction/rent'
+    assert (details['number_of_rooms'], details['number_of_bathrooms']) == ('2', '1')
+    assert details['num_units'] == '12,698 units'
+    assert details['floor_zone'] == 'Middle Floor'
+    assert details['property_type'] == 'Property'
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+# Comparable-lease criteria
+RADIUS_KM = 1.0  # Leases of buildings within this distance of the listing
+MAX_BUILDINGS = 30  # Closest buildings considered, bounds the work in dense areas
+SIZE_TOLERANCE = 0.25  # Relative floor size difference
+MAX_AGE_YEARS = 3  # Before the most recent lease of the history
+MIN_COMPARABLES = 5  # Below this the district average is used
+
+
+def district_averages(df_listing, df_history):
+    """
+    The former `historical_average`: mean over the years of the yearly mean
+    unit price of the listing's district.
+    """
+    df_area_district = df_history[['area_district', 'lease_year', 'unit_price']].dropna().groupby(['area_district', 'lease_year']).mean().unstack()['unit_price']
+    return df_listing['area_district'].map(df_area_district.mean(axis=1))
+
+
+def comparable_estimates(df_listing, df_history, history_index, radius_km=RADIUS_KM, max_buildings=MAX_BUILDINGS,
+                         size_tolerance=SIZE_TOLERANCE, max_age_years=MAX_AGE_YEARS, min_comparables=MIN_COMPARABLES):
+    """
+    Estimate the unit price of each listing from comparable past leases.
+
+    Comparables are the leases of the `max_buildings` closest buildings
+    within `radius_km` (found with `history_index`, a SpatialIndex over
+    `df_history`), with the same number of rooms, a floor size within
+    `size_tolerance` and dated at most `max_age_years` before the latest
+    lease. The estimate is their median unit price; listings with fewer than
+    `min_comparables` fall back to their district average.
+
+    Listings sharing a location are valued together, so the index is queried
+    once per building.
+
+    Returns:
+        DataFrame: 'comparable_estimate', 'comparable_count', 'district_average'
+        and 'historical_average' (the estimate, or the district average as
+        fallback), indexed like `df_listing`.
+    """
+    rooms = pd.Categorical(df_history['Rooms'].astype(object))
+    history_rooms = rooms.codes
+    # Listings without a room count match any lease, room counts never leased match none
+    listing_rooms = pd.Categorical(df_listing['number_of_rooms'].astype(object), categories=rooms.categories).codes
+    listing_rooms = np.where(df_listing['number_of_rooms'].isna(), -1, np.where(listing_rooms == -1, -2, listing_rooms))
+    history_size = df_history['floor_size'].to_numpy(dtype=float)
+    history_price = df_history['unit_price'].to_numpy(dtype=float)
+    cutoff = df_history['lease_date'].max() - pd.DateOffset(years=max_age_years)
+    history_recent = (df_history['lease_date'] >= cutoff).to_numpy()
+
+    listing_size = df_listing['floor_size'].to_numpy(dtype=float)
+    pair_listings, pair_prices = [], []
+
+    coords = df_listing[['latitude', 'longitude']].to_numpy(dtype=float)
+    valid = np.flatnonzero(~np.isnan(coords).any(axis=1))
+    locations, location_of = np.unique(coords[valid], axis=0, return_inverse=True)
+    by_location = np.split(valid[np.argsort(location_of.ravel(), kind='stable')], np.cumsum(np.bincount(location_of.ravel()))[:-1])
+
+    for (latitude, longitude), listings in zip(locations, by_location):
+        points, distances = history_index.points_within(latitude, longitude, radius_km)
+        positions, _ = history_index.row_positions(points[:max_buildings], distances[:max_buildings])
+        positions = positions[history_recent[positions]]
+        if not len(positions):
+            continue
+        # (listings at this location) x (candidate leases)
+        rooms_wanted = listing_rooms[listings, None]
+        same_rooms = (history_rooms[positions] == rooms_wanted) | (rooms_wanted == -1)
+        similar_size = np.abs(history_size[positions] - listing_size[listings, None]) <= size_tolerance * listing_size[listings, None]
+        rows, columns = np.nonzero(same_rooms & similar_size & ~np.isnan(history_price[positions]))
+        pair_listings.append(listings[rows])
+        pair_prices.append(history_price[positions[columns]])
+
+    estimate, count = _grouped_medians(pair_listings, pair_prices, len(df_listing))
+    result = pd.DataFrame({'comparable_estimate': estimate, 'comparable_count': count}, index=df_listing.index)
+    result.loc[result['comparable_count'] < min_comparables, 'comparable_estimate'] = np.nan
+    result['district_average'] = district_averages(df_listing, df_history)
+    result['historical_average'] = result['comparable_estimate'].fillna(result['district_average'])
+    return result
+
+
+
+def _grouped_medians(groups, values, size):
+    """Median and count of `values` per group in range(size), from lists of arrays, in one sort."""
+    groups = np.concatenate(groups) if groups else np.empty(0, dtype=int)
+    values = np.concatenate(values) if values else np.empty(0)
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    count = np.bincount(groups, minlength=size)
+    starts = np.cumsum(count) - count
+    median = np.full(size, np.nan)
+    has = count > 0
+    low = starts[has] + (count[has] - 1) // 2
+    high = starts[has] + count[has] // 2
+    median[has] = (values[low] + values[high]) / 2
+    return median, count
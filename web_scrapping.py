@@ -1,22 +1,25 @@
-import requests
 from bs4 import BeautifulSoup
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import concurrent.futures
 import time
-import random
 import pandas as pd
 import numpy as np
 import json
-import streamlit as st
+from crawl_engine import get_engine
+from pipeline import fetch_and_parse
+from progress import get_reporter
+from parsers import FAST_PARSER_AVAILABLE, parse_property_details_fast
+from schema import DATE_FORMATS, HISTORY_KEY
 
 # 1. WEB_SCRAPPING LIST OF PROPERTY NUMBERS
 
+def number_of_pages_from_soup(soup):
+    page_numbers = [a.get_text(strip=True) for a in soup.find_all('a', class_='item') if a.get_text(strip=True).isdigit()]
+    return int(page_numbers[-1]) if page_numbers else 1
+
 def number_of_pages_listing():
     base_url = 'https://www.28hse.com/en/rent/residential'
-    response = requests.get(base_url)
-    soup = BeautifulSoup(response.content, 'html.parser')
-    page_numbers = [a.get_text(strip=True) for a in soup.find_all('a', class_='item') if a.get_text(strip=True).isdigit()]
-    return int(page_numbers[-1])
+    html_content = get_engine().fetch_one(base_url)
+    soup = BeautifulSoup(html_content, 'html.parser')
+    return number_of_pages_from_soup(soup)
 
 def extract_property_nums_from_soup(soup):
     listings = soup.find_all('a', class_='detail_page')
@@ -39,62 +42,85 @@ def extract_property_nums_from_soup(soup):
     return list(set(listing_numbers))
 
 
-def list_of_properties_scrapping():
+LISTING_PAGE_URL = "https://www.28hse.com/en/rent/residential?page={page}&sortBy={sort_by}&search_words_thing=default&buyRent=rent&propertyDoSearchVersion=2.0"
+SORT_BY_DATE = 'dateDesc'  # Newest listings first
+
+def list_of_properties_scrapping(progress=None):
     # Base URL template
-    base_url = "https://www.28hse.com/en/rent/residential?page={page}&sortBy=default&search_words_thing=default&buyRent=rent&propertyDoSearchVersion=2.0"
-    
-    # Function to fetch and parse a page with retries
-    def fetch_page(page, total_pages, progress_bar, max_retries=2):
-        progress_pct = int((page / total_pages) * 100)
-        st.markdown(progress_pct)
-        progress_bar.progress(progress_pct)
-        url = base_url.format(page=page)
-        
-        for attempt in range(max_retries + 1):  # Try up to max_retries times
-            try:
-                print(f"Fetching page {page}/{total_pages}, attempt {attempt + 1}...")
-                response = requests.get(url, timeout=10)  # Set timeout to prevent hanging
-                
-                response.raise_for_status()  # Raise an exception for HTTP errors
-                if response.status_code == 200:
-                    soup = BeautifulSoup(response.content, 'html.parser')
-                    return extract_property_nums_from_soup(soup)  # Extract property numbers
-                
-                print(f"Failed to fetch page {page} with status code {response.status_code}")
-            except requests.RequestException as e:
-                print(f"Error fetching page {page} (attempt {attempt + 1}): {e}")
-                if attempt < max_retries:
-                    time.sleep(2 ** attempt)  # Exponential backoff before retrying
-            
-        print(f"Giving up on page {page} after {max_retries + 1} attempts.")
-        return []  # Return empty list if all attempts fail
+    base_url = LISTING_PAGE_URL.format(page='{page}', sort_by='default')
 
     # Initialize a list to collect property numbers
     property_numbers = []
-    
+
     # Get total pages dynamically
     total_pages = number_of_pages_listing()
-    progress_bar = st.progress(0)
-    
-    # Use ThreadPoolExecutor to fetch pages in parallel
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        # Submit tasks for all pages
-        future_to_page = {executor.submit(fetch_page, page, total_pages, progress_bar): page for page in range(1, total_pages + 1)}
-    
-        # Process results as they complete
-        for future in as_completed(future_to_page):
-            page = future_to_page[future]
-            try:
-                # Collect the property numbers from the completed task
-                property_numbers.extend(future.result())
-            except Exception as e:
-                print(f"Error processing page {page}: {e}")
-    
+    progress = get_reporter(progress)
+    progress.start("Listing pages", total_pages)
+    urls = [base_url.format(page=page) for page in range(1, total_pages + 1)]
+
+    # Pages are fetched concurrently by the shared engine and handed back as they complete
+    for done, (url, html_content) in enumerate(get_engine().iter_fetch(urls), start=1):
+        progress.update(done)
+        if html_content is None:
+            print(f"Giving up on page {url}")
+            continue
+        try:
+            soup = BeautifulSoup(html_content, 'html.parser')
+            property_numbers.extend(extract_property_nums_from_soup(soup))
+        except Exception as e:
+            print(f"Error processing page {url}: {e}")
+
+    progress.finish()
+
     # Print the total number of properties collected
     print(f"Collected {len(property_numbers)} property numbers")
     return [int(n) for n in property_numbers]
 
 
+def list_of_new_properties_scrapping(known_numbers, stop_after_known_pages=3):
+    """
+    Incrementally collect property numbers that are not in `known_numbers` yet.
+
+    Index pages are walked newest first and the crawl stops once
+    `stop_after_known_pages` consecutive pages only contain known property
+    numbers. Delisted properties are not detected, a full sweep with
+    `list_of_properties_scrapping` is still needed for that.
+
+    Parameters:
+        known_numbers (iterable): Property numbers already in the database.
+        stop_after_known_pages (int): Number of consecutive fully known pages after which to stop.
+
+    Returns:
+        list: The new property numbers, as int.
+    """
+    known_numbers = {int(n) for n in known_numbers}
+    new_numbers = []
+    total_pages = number_of_pages_listing()
+    known_pages_in_a_row = 0
+    next_page = 1
+
+    # Pages are fetched in small concurrent batches and examined in page order
+    while next_page <= total_pages and known_pages_in_a_row < stop_after_known_pages:
+        pages = range(next_page, min(next_page + stop_after_known_pages, total_pages + 1))
+        urls = [LISTING_PAGE_URL.format(page=page, sort_by=SORT_BY_DATE) for page in pages]
+        for page, html_content in zip(pages, get_engine().fetch_all(urls)):
+            if html_content is None:
+                print(f"Giving up on page {page}")
+                known_pages_in_a_row = 0
+                continue
+            page_numbers = {int(n) for n in extract_property_nums_from_soup(BeautifulSoup(html_content, 'html.parser'))}
+            unseen = page_numbers - known_numbers
+            new_numbers.extend(unseen)
+            known_numbers.update(unseen)
+            known_pages_in_a_row = 0 if unseen or not page_numbers else known_pages_in_a_row + 1
+            if known_pages_in_a_row >= stop_after_known_pages:
+                break
+        next_page = pages[-1] + 1
+
+    print(f"Collected {len(new_numbers)} new property numbers from {next_page - 1} pages")
+    return new_numbers
+
+
 # 2. WEB_SCRAPPING PROPERTIES DETAILS
 
 def extract_estate_info(soup):
@@ -201,16 +227,34 @@ def get_property_details_from_soup(data_dict, soup):
     data_dict['unit_price'] = soup.find('div', class_='pairSubValue').get_text(strip=True) if soup.find('div', class_='pairSubValue') else 'Not available'
     return data_dict
 
-def get_property_details(prop_num):
-    url = f'https://www.28hse.com/en/rent/residential/property-{prop_num}'
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        print(f"Failed to fetch the property: {prop_num}")
-        print(url)
-        return {}
-    
-    soup = BeautifulSoup(response.text, 'html.parser')
+PARSER_BACKEND = 'fast'  # 'fast' (lxml, single pass) or 'soup' (BeautifulSoup)
+
+def property_url(prop_num):
+    return f'https://www.28hse.com/en/rent/residential/property-{prop_num}'
+
+def parse_property_details(prop_num, html_content, backend=None):
+    """
+    Extract the `property_details` dict of a detail page.
+
+    The fast lxml backend is used when available; pages it cannot handle are
+    parsed again with BeautifulSoup, which both produce the same dict.
+
+    Parameters:
+        prop_num (int): The property number.
+        html_content (str): HTML of the property detail page.
+        backend (str): 'fast' or 'soup', defaults to PARSER_BACKEND.
+    """
+    backend = backend or PARSER_BACKEND
+    if backend == 'fast' and FAST_PARSER_AVAILABLE:
+        try:
+            return parse_property_details_fast(prop_num, html_content, property_url(prop_num))
+        except Exception:
+            pass  # Unusual page, the soup path decides how to handle it
+    return parse_property_details_soup(prop_num, html_content)
+
+def parse_property_details_soup(prop_num, html_content):
+    url = property_url(prop_num)
+    soup = BeautifulSoup(html_content, 'html.parser')
     if soup is None:
         return {}
     
@@ -242,15 +286,31 @@ def get_property_details(prop_num):
 
     return property_details
 
-def get_properties_dataframe_parallel(property_numbers):
+def get_property_details(prop_num):
+    url = property_url(prop_num)
+    html_content = get_engine().fetch_one(url)
+    
+    if html_content is None:
+        print(f"Failed to fetch the property: {prop_num}")
+        print(url)
+        return {}
+
+    return parse_property_details(prop_num, html_content)
+
+def parse_property_page(url, html_content):
+    """Parse-stage entry point for detail pages (runs in a worker process)."""
+    return parse_property_details(int(url.rsplit('-', 1)[-1]), html_content)
+
+def get_properties_dataframe_parallel(property_numbers, parse_workers=None, progress=None):
     start_time = time.time()
     properties_data = []
 
-    # Use ThreadPoolExecutor to scrape multiple pages concurrently
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(get_property_details, prop_num) for prop_num in property_numbers]
-        for future in concurrent.futures.as_completed(futures):
-            properties_data.append(future.result())
+    # Detail pages are fetched by the shared engine and parsed in worker processes
+    for url, property_details in fetch_and_parse([property_url(prop_num) for prop_num in property_numbers], parse_property_page, parse_workers=parse_workers, progress=progress, label="Property details"):
+        if property_details is None:
+            print(f"Failed to fetch the property: {url}")
+            property_details = {}
+        properties_data.append(property_details)
 
     # Convert to DataFrame
     df = pd.DataFrame(properties_data)
@@ -259,6 +319,7 @@ def get_properties_dataframe_parallel(property_numbers):
     end_time = time.time()
     execution_time = end_time - start_time
     print(f"Execution Time: {execution_time:.4f} seconds")
+    print(f"HTTP stats: {get_engine().stats()}")
     
     return df
 
@@ -266,10 +327,9 @@ def get_properties_dataframe_parallel(property_numbers):
 # 3. WEB_SCRAPPING LEASING HISTORY
 
 def number_of_pages_building(base_url):
-    response = requests.get(base_url)
-    soup = BeautifulSoup(response.content, 'html.parser')
-    page_numbers = [a.get_text(strip=True) for a in soup.find_all('a', class_='item') if a.get_text(strip=True).isdigit()]
-    return int(page_numbers[-1])
+    html_content = get_engine().fetch_one(base_url)
+    soup = BeautifulSoup(html_content, 'html.parser')
+    return number_of_pages_from_soup(soup)
 
 
 def parse_flats_from_page(html_content):
@@ -317,105 +377,92 @@ def parse_flats_from_page(html_content):
 
     return flats
 
-def fetch_page_building(url):
-    """Fetches a single page and returns its HTML content."""
-    headers = {"User-Agent": "Mozilla/5.0"}
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        return response.text
-    return None
-
-def scrape_all_pages_building(base_url, total_pages, max_workers=5):
-    """Scrapes multiple pages in parallel and aggregates data."""
-    urls = [f"{base_url}/page-{i}" for i in range(1, total_pages + 1)]
-    flats_data = []
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = executor.map(fetch_page_building, urls)
-
-    for html_content in results:
-        if html_content:
-            flats_data.extend(parse_flats_from_page(html_content))
-
-    return flats_data
-
+def building_page_urls(base_url, total_pages):
+    return [f"{base_url}/page-{i}" for i in range(1, total_pages + 1)]
 
-def fetch_page_with_retries(url, max_retries=3):
-    """Fetch a page with retry logic and exponential backoff."""
-    attempt = 0
-    while attempt < max_retries:
-        try:
-            html_content = fetch_page_building(url)
-            if html_content:
-                return html_content
-            else:
-                raise ValueError("Empty page response")
-        except Exception as e:
-            print(f"Error fetching {url} (attempt {attempt+1}): {e}")
-            attempt += 1
-            time.sleep(2 ** attempt + random.uniform(0, 1))  # Exponential backoff
+def parse_history_page(url, html_content):
+    """Parse-stage entry point for history pages (runs in a worker process)."""
+    return parse_flats_from_page(html_content)
 
-    print(f"Failed to fetch {url} after {max_retries} attempts")
-    return None  # Return None if all attempts fail
+def parse_history_first_page(url, html_content):
+    """Parse-stage entry point for the first history page of a building: (total_pages, flats)."""
+    total_pages = number_of_pages_from_soup(BeautifulSoup(html_content, 'html.parser'))
+    return total_pages, parse_flats_from_page(html_content)
 
-def scrape_all_pages_building(base_url, total_pages, max_workers=5):
-    """Scrapes multiple pages in parallel and aggregates data with error handling."""
-    urls = [f"{base_url}/page-{i}" for i in range(1, total_pages + 1)]
+def scrape_all_pages_building(base_url, total_pages, parse_workers=None):
+    """Scrapes all pages of a building concurrently and aggregates data with error handling."""
     flats_data = []
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_url = {executor.submit(fetch_page_with_retries, url): url for url in urls}
-
-        for future in as_completed(future_to_url):
-            try:
-                html_content = future.result()
-                if html_content:
-                    flats_data.extend(parse_flats_from_page(html_content))
-            except Exception as e:
-                print(f"Error processing {future_to_url[future]}: {e}")
+    for url, flats in fetch_and_parse(building_page_urls(base_url, total_pages), parse_history_page, parse_workers=parse_workers):
+        if flats:
+            flats_data.extend(flats)
 
     return flats_data
 
 
-def scrape_building_with_metadata(url_history, property_df):
-    """Scrape lease history for a given URL with associated metadata."""
+def building_metadata(property_df):
+    """url_history -> (address, latitude, longitude) of the first listing of each building."""
+    buildings = property_df.dropna(subset=['url_history']).drop_duplicates('url_history')
+    return dict(zip(buildings['url_history'], zip(buildings['address'], buildings['latitude'], buildings['longitude'])))
+
+def lease_dates(flats):
+    """Lease dates of parsed flats, NaT where the date could not be read."""
+    return pd.to_datetime(pd.Series([flat["Lease Date"] for flat in flats], dtype=object), format=DATE_FORMATS['Lease Date'], errors='coerce')
+
+def reaches_high_water_mark(flats, high_water_mark):
+    """True once a page (newest leases first) goes back to the latest lease already stored."""
+    return not flats or not lease_dates(flats).min() > high_water_mark
+
+def building_frame(url_history, flats_data, metadata, high_water_mark=None):
+    """Leases of a building with its history URL, address and coordinates, without those older than `high_water_mark`."""
+    if high_water_mark is not None:
+        flats_data = [flat for flat, date in zip(flats_data, lease_dates(flats_data)) if not date < high_water_mark]
+    address, latitude, longitude = metadata
+    df_building = pd.DataFrame(flats_data)
+    df_building['address'] = address
+    df_building['latitude'] = latitude
+    df_building['longitude'] = longitude
+    df_building['url_history'] = url_history
+    return df_building
+
+def scrape_building_with_metadata(url_history, metadata, high_water_mark=None):
+    """
+    Scrape the lease history of a building with its address and coordinates.
+
+    Parameters:
+        url_history (str): History URL of the building.
+        metadata (dict): url_history -> (address, latitude, longitude), see `building_metadata`.
+        high_water_mark (Timestamp): Latest lease date already stored. Pages,
+            newest first, are only scraped until it is reached.
+    """
     try:
         total_pages = number_of_pages_building(url_history)
-        address = property_df.loc[property_df['url_history'] == url_history, 'address'].iloc[0]
-        latitude = property_df.loc[property_df['url_history'] == url_history, 'latitude'].iloc[0]
-        longitude = property_df.loc[property_df['url_history'] == url_history, 'longitude'].iloc[0]
-
-        flats_data = scrape_all_pages_building(url_history, total_pages)
-        
-        df_building = pd.DataFrame(flats_data)
-        df_building['address'] = address
-        df_building['latitude'] = latitude
-        df_building['longitude'] = longitude
-
-        return df_building
+        if high_water_mark is None:
+            flats_data = scrape_all_pages_building(url_history, total_pages)
+        else:
+            flats_data = []
+            for page_url in building_page_urls(url_history, total_pages):
+                page = get_engine().fetch_one(page_url)
+                if page is None:
+                    # As in get_lease_history_parallel, the walk stops at a failed page
+                    print(f"Error with {page_url}: page could not be fetched, keeping the previous pages")
+                    break
+                flats = parse_flats_from_page(page)
+                flats_data.extend(flats)
+                if reaches_high_water_mark(flats, high_water_mark):
+                    break
+        return building_frame(url_history, flats_data, metadata[url_history], high_water_mark)
     except Exception as e:
         print(f"Error with {url_history}: {e}")
         return None
     
-def get_lease_history(property_df):
+def get_lease_history(property_df, high_water_marks=None):
     start_time = time.time()
-    list_of_url_history = list(set(property_df.dropna(subset=['url_history'])['url_history']))
-    flats_data=[]
-    df_history=pd.DataFrame([])
-    for url_history in list_of_url_history:
-        try :
-            total_pages = number_of_pages_building(url_history)
-            address = property_df[lambda x : x.url_history==url_history].iloc[0]['address']
-            latitude = property_df[lambda x : x.url_history==url_history].iloc[0]['latitude']
-            longitude = property_df[lambda x : x.url_history==url_history].iloc[0]['longitude']
-            flats_data = scrape_all_pages_building(url_history, total_pages)
-            df_building = pd.DataFrame(flats_data)
-            df_building['address']=address
-            df_building['latitude']=latitude
-            df_building['longitude']=longitude
-            df_history = pd.concat([df_history,df_building])
-        except:
-            print(f'error with {url_history}')
+    metadata = building_metadata(property_df)
+    high_water_marks = high_water_marks or {}
+    buildings = [scrape_building_with_metadata(url_history, metadata, high_water_marks.get(url_history)) for url_history in metadata]
+    buildings = [df_building for df_building in buildings if df_building is not None and not df_building.empty]
+    df_history = pd.concat(buildings, ignore_index=True).drop_duplicates(HISTORY_KEY) if buildings else pd.DataFrame([])
 
     # End timer
     end_time = time.time()
@@ -423,17 +470,70 @@ def get_lease_history(property_df):
     print(f"Execution Time: {execution_time:.4f} seconds")
     return df_history
 
-def get_lease_history_parallel(list_of_url_history, property_df, max_workers=5):
-    """Fetch lease history in parallel and aggregate results."""
-    df_history = pd.DataFrame([])
+def next_history_pages(url_history, page, total_pages, flats, high_water_mark=None):
+    """
+    History pages of a building to fetch after `page`, as {page_url: (url_history, page number)}.
+
+    Without a high-water mark all the pages after the first are fetched at
+    once; with one, the next page is only fetched while the leases of this
+    one are all more recent than the mark.
+    """
+    if high_water_mark is None:
+        pages = range(2, total_pages + 1) if page == 1 else []
+    else:
+        pages = [page + 1] if page < total_pages and not reaches_high_water_mark(flats, high_water_mark) else []
+    return {f"{url_history}/page-{number}": (url_history, number) for number in pages}
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_url = {executor.submit(scrape_building_with_metadata, url, property_df): url for url in list_of_url_history}
+def get_lease_history_parallel(list_of_url_history, property_df, parse_workers=None, progress=None, high_water_marks=None):
+    """
+    Fetch lease history of all buildings through the shared engine and aggregate results.
 
-        for future in as_completed(future_to_url):
-            result = future.result()
-            if result is not None:
-                df_history = pd.concat([df_history, result], ignore_index=True)
+    `high_water_marks` maps a url_history to the latest lease date already
+    stored for the building: its pages are then fetched one round at a time,
+    newest first, until that date is reached, and older leases are dropped.
+    Leases are deduplicated on HISTORY_KEY.
+    """
+    engine = get_engine()
+    metadata = building_metadata(property_df)
+    high_water_marks = high_water_marks or {}
+    list_of_url_history = list(dict.fromkeys(list_of_url_history))
+    flats_by_building = {}
+    total_pages_by_building = {}
+    pending_pages = {}
+
+    # First pages tell how many pages each building has; they are parsed right away
+    first_pages = [building_page_urls(url, 1)[0] for url in list_of_url_history]
+    for first_page_url, result in fetch_and_parse(first_pages, parse_history_first_page, engine, parse_workers, progress=progress, label="History first pages"):
+        url_history = first_page_url[:-len("/page-1")]
+        if result is None:
+            print(f"Error with {url_history}: first page could not be scraped")
+            continue
+        total_pages, flats = result
+        flats_by_building[url_history] = flats
+        total_pages_by_building[url_history] = total_pages
+        pending_pages.update(next_history_pages(url_history, 1, total_pages, flats, high_water_marks.get(url_history)))
+
+    # Remaining pages are fetched and parsed in batches: every page of the buildings
+    # without a mark in the first one, then one page per round for the others
+    while pending_pages:
+        round_pages, pending_pages = pending_pages, {}
+        for page_url, flats in fetch_and_parse(round_pages, parse_history_page, engine, parse_workers, progress=progress, label="History pages"):
+            if flats:
+                url_history, page = round_pages[page_url]
+                flats_by_building[url_history].extend(flats)
+                pending_pages.update(next_history_pages(url_history, page, total_pages_by_building[url_history], flats, high_water_marks.get(url_history)))
+
+    buildings = []
+    for url_history in list_of_url_history:
+        if url_history not in flats_by_building:
+            continue
+        try:
+            df_building = building_frame(url_history, flats_by_building[url_history], metadata[url_history], high_water_marks.get(url_history))
+        except Exception as e:
+            print(f"Error with {url_history}: {e}")
+            continue
+        if not df_building.empty:
+            buildings.append(df_building)
 
-    return df_history
-    
+    print(f"HTTP stats: {engine.stats()}")
+    return pd.concat(buildings, ignore_index=True).drop_duplicates(HISTORY_KEY) if buildings else pd.DataFrame([])